@@ -0,0 +1,27 @@
+from typing import List
+
+from benchmarks.generators import generate_table_cells, generate_words, generate_paddle_fields
+from benchmarks.harness import BenchCase
+from table_extractor.pipeline.pipeline import merge_text_fields
+from table_extractor.text_cells_matcher.text_cells_matcher import match_cells_text_fields
+
+
+def cases(sizes: List[int]) -> List[BenchCase]:
+    bench_cases = []
+    for n_cells in sizes:
+        _, cells, _ = generate_table_cells(n_cells)
+        words = generate_words(cells)
+        paddle_fields = generate_paddle_fields(words)
+        bench_cases.append(BenchCase(
+            name='match_cells_text_fields',
+            size=f"{n_cells}_cells",
+            setup=lambda cells=cells, words=words: (cells, words),
+            func=match_cells_text_fields
+        ))
+        bench_cases.append(BenchCase(
+            name='merge_text_fields',
+            size=f"{n_cells}_cells",
+            setup=lambda words=words, paddle_fields=paddle_fields: (paddle_fields, words),
+            func=merge_text_fields
+        ))
+    return bench_cases
@@ -0,0 +1,27 @@
+from typing import List, Tuple
+
+from benchmarks.generators import generate_table_image, binarize, DPI
+from benchmarks.harness import BenchCase
+from table_extractor.borderless_service.semi_bordered import find_gaps, parse_semi_bordered
+
+
+def cases(crops: List[Tuple[str, float, float]]) -> List[BenchCase]:
+    bench_cases = []
+    for crop_name, width, height in crops:
+        img = generate_table_image(width, height)
+        img_bin = binarize(img)
+        size = f"{crop_name}_{DPI}dpi"
+        for axis in (0, 1):
+            bench_cases.append(BenchCase(
+                name=f'find_gaps_axis{axis}',
+                size=size,
+                setup=lambda img_bin=img_bin, axis=axis: (img_bin, axis, 255, 3),
+                func=find_gaps
+            ))
+        bench_cases.append(BenchCase(
+            name='parse_semi_bordered',
+            size=size,
+            setup=lambda img=img: (img.copy(),),
+            func=parse_semi_bordered
+        ))
+    return bench_cases
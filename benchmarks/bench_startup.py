@@ -0,0 +1,62 @@
+import json
+import logging
+import subprocess
+import sys
+from typing import List, Tuple, Dict
+
+from benchmarks.harness import BenchCase
+
+logger = logging.getLogger(__name__)
+
+# (case size, command line module)
+ENTRY_POINTS = [
+    ('run_help', 'table_extractor.run'),
+    ('excel_run_help', 'table_extractor.excel_run'),
+]
+# Backends which should be imported only by commands actually running models
+HEAVY_MODULES = ('torch', 'mmcv', 'mmdet', 'paddle', 'paddleocr', 'tesserocr', 'nltk')
+
+_CHECK_IMPORTS = """
+import importlib, json, sys
+importlib.import_module(sys.argv[1])
+print(json.dumps(sorted(name for name in sys.argv[2:] if name in sys.modules)))
+"""
+
+
+def _run_help(module: str):
+    subprocess.run([sys.executable, '-m', module, '--help'], check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def heavy_imports(entry_points: List[Tuple[str, str]] = ENTRY_POINTS) -> Dict[str, List[str]]:
+    """
+    Heavy backends loaded by a bare import of every entry point module
+    """
+    loaded = {}
+    for _, module in entry_points:
+        result = subprocess.run([sys.executable, '-c', _CHECK_IMPORTS, module, *HEAVY_MODULES],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode:
+            logger.warning("Can't import %s: %s", module, result.stderr.decode().strip().splitlines()[-1:])
+            continue
+        loaded[module] = json.loads(result.stdout.decode())
+        if loaded[module]:
+            logger.warning("%s imports %s at startup", module, ', '.join(loaded[module]))
+    return loaded
+
+
+def cases(entry_points: List[Tuple[str, str]]) -> List[BenchCase]:
+    bench_cases = []
+    for size, module in entry_points:
+        try:
+            _run_help(module)
+        except subprocess.CalledProcessError:
+            logger.warning("Skipping startup of %s, it fails to start in this environment", module)
+            continue
+        bench_cases.append(BenchCase(
+            name='startup',
+            size=size,
+            setup=lambda: (),
+            func=lambda module=module: _run_help(module)
+        ))
+    return bench_cases
@@ -0,0 +1,78 @@
+from typing import List, Tuple
+
+from benchmarks.generators import generate_table_cells
+from benchmarks.harness import BenchCase
+from table_extractor.inference_table_service.constuct_table_from_inference import construct_table_from_cells, \
+    _actualize_line_separators, _find_lines, _match_cells_and_table
+from table_extractor.model.table import BorderBox, Cell, ImplicitGridTable, StructuredTable
+
+
+def _initial_grid(table_bbox: BorderBox, cells: List[Cell], image_shape: Tuple[int, int]) \
+        -> ImplicitGridTable:
+    """
+    First grid of construct_table_from_cells, spanning cells hide column gaps so grid cells get several cells
+    """
+    h_lines, v_lines = _find_lines(table_bbox, cells, image_shape)
+    h_lines = [table_bbox.top_left_y] + h_lines + [table_bbox.bottom_right_y]
+    v_lines = [table_bbox.top_left_x] + v_lines + [table_bbox.bottom_right_x]
+    grid_table = ImplicitGridTable(h_lines, v_lines)
+    _match_cells_and_table(grid_table, cells)
+    return grid_table
+
+
+def _checked_table(table_bbox: BorderBox, cells: List[Cell], image_shape: Tuple[int, int]) -> StructuredTable:
+    """
+    Constructed table with slot lookups checked against a scan over its cells
+    """
+    table = construct_table_from_cells(table_bbox, cells, image_shape)
+    for cell in table.cells:
+        rows = range(cell.row, cell.row + max(1, cell.row_span))
+        cols = range(cell.col, cell.col + max(1, cell.col_span))
+        if any(table.cell_at(row, col) is None for row in rows for col in cols):
+            raise ValueError(f"Slot of cell {cell.row}:{cell.col} is empty")
+        if any(cell not in table.row_cells(row, with_spans=True) for row in rows) \
+                or any(cell not in table.col_cells(col, with_spans=True) for col in cols):
+            raise ValueError(f"Spans of cell {cell.row}:{cell.col} are not indexed")
+    for row in table.rows:
+        if table.row_cells(row[0].row) != row:
+            raise ValueError(f"Row {row[0].row} differs from cells scan")
+    return table
+
+
+def _lookup_slots(table: StructuredTable):
+    n_rows = len(table.cell_index.row_nums)
+    n_cols = len(table.cell_index.col_nums)
+    for row in range(n_rows):
+        table.row_cells(row, with_spans=True)
+        for col in range(n_cols):
+            table.cell_at(row, col)
+    for col in range(n_cols):
+        table.col_cells(col, with_spans=True)
+
+
+def cases(sizes: List[int]) -> List[BenchCase]:
+    bench_cases = []
+    for n_cells in sizes:
+        table_bbox, cells, image_shape = generate_table_cells(n_cells)
+        bench_cases.append(BenchCase(
+            name='construct_table_from_cells',
+            size=f"{n_cells}_cells",
+            setup=lambda table_bbox=table_bbox, cells=cells, image_shape=image_shape: (table_bbox, cells, image_shape),
+            func=construct_table_from_cells
+        ))
+        bench_cases.append(BenchCase(
+            name='_actualize_line_separators',
+            size=f"{n_cells}_cells",
+            setup=lambda table_bbox=table_bbox, cells=cells, image_shape=image_shape: (
+                _initial_grid(table_bbox, cells, image_shape), image_shape
+            ),
+            func=_actualize_line_separators
+        ))
+        table = _checked_table(table_bbox, cells, image_shape)
+        bench_cases.append(BenchCase(
+            name='structured_table_lookup',
+            size=f"{n_cells}_cells",
+            setup=lambda table=table: (table,),
+            func=_lookup_slots
+        ))
+    return bench_cases
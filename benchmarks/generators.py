@@ -0,0 +1,165 @@
+import math
+import random
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from table_extractor.model.table import BorderBox, Cell, TextField
+
+DPI = 400
+# US letter page rendered with pipeline DPI
+PAGE_SHAPE = (int(11 * DPI), int(8.5 * DPI))
+CELL_WIDTH = 260
+CELL_HEIGHT = 90
+TABLE_MARGIN = 100
+
+# (name, width, height) in inches
+CROP_SIZES = [
+    ('small', 3., 1.5),
+    ('half_page', 7.5, 5.),
+    ('full_page', 8.5, 11.),
+]
+
+WORD_HEIGHT = 0.1
+WORD_WIDTH = (0.2, 0.6)
+ROW_HEIGHT = 0.3
+
+
+def _grid_shape(n_cells: int) -> Tuple[int, int]:
+    n_cols = max(2, int(math.sqrt(n_cells)))
+    n_rows = max(2, math.ceil(n_cells / n_cols))
+    return n_rows, n_cols
+
+
+def generate_table_cells(n_cells: int, span_every: int = 3, seed: int = 0) \
+        -> Tuple[BorderBox, List[Cell], Tuple[int, int]]:
+    """
+    Generate Cascade like cell detections laid out in a grid
+    @param n_cells: number of grid slots, spanning cells take two of them
+    @param span_every: every span_every row has a cell spanning two columns, 0 disables spans
+    @param seed: seed of box jitter
+    @return: table bbox, cells in detection order and page image shape (h, w)
+    """
+    rnd = random.Random(seed)
+    n_rows, n_cols = _grid_shape(n_cells)
+    table_bbox = BorderBox(
+        top_left_x=TABLE_MARGIN,
+        top_left_y=TABLE_MARGIN,
+        bottom_right_x=TABLE_MARGIN + n_cols * CELL_WIDTH,
+        bottom_right_y=TABLE_MARGIN + n_rows * CELL_HEIGHT,
+    )
+    cells = []
+    slot = 0
+    for row in range(n_rows):
+        col = 0
+        while col < n_cols and slot < n_cells:
+            span = 2 if span_every and row % span_every == span_every - 1 and col == 1 and col + 1 < n_cols else 1
+            x = TABLE_MARGIN + col * CELL_WIDTH
+            y = TABLE_MARGIN + row * CELL_HEIGHT
+            cells.append(Cell(
+                top_left_x=x + rnd.randint(10, 30),
+                top_left_y=y + rnd.randint(10, 20),
+                bottom_right_x=x + span * CELL_WIDTH - rnd.randint(10, 30),
+                bottom_right_y=y + CELL_HEIGHT - rnd.randint(10, 20),
+                confidence=rnd.uniform(0.5, 1.)
+            ))
+            col += span
+            slot += span
+    rnd.shuffle(cells)
+    image_shape = (
+        max(PAGE_SHAPE[0], table_bbox.bottom_right_y + TABLE_MARGIN),
+        max(PAGE_SHAPE[1], table_bbox.bottom_right_x + TABLE_MARGIN),
+    )
+    return table_bbox, cells, image_shape
+
+
+def generate_words(cells: List[BorderBox], words_per_cell: int = 3, seed: int = 0) -> List[TextField]:
+    """
+    Generate poppler like word boxes placed in a line inside every cell
+    """
+    rnd = random.Random(seed)
+    words = []
+    for cell in cells:
+        word_width = max(1, (cell.width - 10) // words_per_cell)
+        y1 = cell.top_left_y + 5
+        y2 = max(y1 + 1, min(cell.bottom_right_y - 5, y1 + int(WORD_HEIGHT * DPI)))
+        for idx in range(words_per_cell):
+            x1 = cell.top_left_x + 5 + idx * word_width
+            words.append(TextField(
+                bbox=BorderBox(
+                    top_left_x=x1,
+                    top_left_y=y1,
+                    bottom_right_x=x1 + max(1, word_width - rnd.randint(5, 15)),
+                    bottom_right_y=y2,
+                ),
+                text=''.join(rnd.choice('abcdefghij0123456789') for _ in range(rnd.randint(2, 8)))
+            ))
+    return words
+
+
+def generate_paddle_fields(words: List[TextField], words_per_line: int = 3, seed: int = 0) -> List[TextField]:
+    """
+    Generate paddle like text line boxes, each one covering words_per_line consecutive words with a few pixels jitter
+    """
+    rnd = random.Random(seed)
+    lines = []
+    for idx in range(0, len(words), words_per_line):
+        line = words[idx:idx + words_per_line]
+        bbox = line[0].bbox
+        for word in line[1:]:
+            bbox = bbox.merge(word.bbox)
+        lines.append(TextField(
+            bbox=BorderBox(
+                top_left_x=bbox.top_left_x - rnd.randint(0, 4),
+                top_left_y=bbox.top_left_y - rnd.randint(0, 4),
+                bottom_right_x=bbox.bottom_right_x + rnd.randint(0, 4),
+                bottom_right_y=bbox.bottom_right_y + rnd.randint(0, 4),
+            ),
+            text=''
+        ))
+    rnd.shuffle(lines)
+    return lines
+
+
+def generate_table_image(width: float, height: float, dpi: int = DPI, n_cols: Optional[int] = None,
+                         seed: int = 0) -> np.ndarray:
+    """
+    Draw semi bordered table: full width horizontal rules under header, between body rows and at the bottom,
+    and dark word blobs in columns separated by white gaps
+    @param width: crop width in inches
+    @param height: crop height in inches
+    @return: BGR uint8 image like a rendered page crop
+    """
+    rnd = np.random.RandomState(seed)
+    h, w = int(height * dpi), int(width * dpi)
+    img = np.full((h, w, 3), 255, dtype=np.uint8)
+    n_cols = n_cols or max(2, int(width * 1.2))
+    col_width = w // n_cols
+    row_height = max(4, int(ROW_HEIGHT * dpi))
+    word_height = max(2, int(WORD_HEIGHT * dpi))
+    rule = max(1, dpi // 100)
+
+    def draw_rule(y):
+        img[y:y + rule, :] = 0
+
+    draw_rule(0)
+    for row_idx, y in enumerate(range(rule + row_height // 4, h - row_height, row_height)):
+        for col in range(n_cols):
+            x = col * col_width + int(0.05 * col_width)
+            word_width = int(rnd.uniform(*WORD_WIDTH) * dpi)
+            x2 = min(x + word_width, (col + 1) * col_width - int(0.15 * col_width))
+            if x2 > x:
+                img[y:y + word_height, x:x2] = rnd.randint(0, 60)
+        # Rule under the header and every few body rows
+        if row_idx == 0 or row_idx % 4 == 3:
+            draw_rule(y + word_height + (row_height - word_height) // 2)
+    draw_rule(h - rule)
+    return img
+
+
+def binarize(img: np.ndarray) -> np.ndarray:
+    """
+    Grayscale 0/255 image as get_column_mask/get_row_mask pass it to find_gaps
+    """
+    gray = img.mean(axis=2) if img.ndim == 3 else img
+    return np.where(gray > 128, 255, 0).astype(np.uint8)
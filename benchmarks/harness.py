@@ -0,0 +1,114 @@
+import gc
+import logging
+import platform
+import subprocess
+import time
+from statistics import median
+from typing import Callable, Tuple, List, Dict, Any, Optional
+
+from dataclasses import dataclass
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MIN_REPEAT = 3
+MAX_REPEAT = 50
+# Stop repeating once this much time was measured and MIN_REPEAT runs are done
+MIN_TIME = 0.5
+# Slow cases stop after this much time even below MIN_REPEAT runs
+MAX_TIME = 30.
+# Relative change of best time reported as regression or improvement
+CHANGE_THRESHOLD = 0.1
+
+
+@dataclass
+class BenchCase:
+    """
+    Single benchmark case, setup builds fresh arguments for each run and is not timed,
+    so kernels mutating their input are measured on the same data every run
+    """
+    name: str
+    size: str
+    setup: Callable[[], Tuple]
+    func: Callable
+
+    @property
+    def key(self):
+        return f"{self.name}[{self.size}]"
+
+
+def measure(case: BenchCase, min_repeat: int = MIN_REPEAT, max_repeat: int = MAX_REPEAT,
+            min_time: float = MIN_TIME, max_time: float = MAX_TIME) -> Dict[str, Any]:
+    times = []
+    while len(times) < max_repeat:
+        args = case.setup()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            case.func(*args)
+            times.append(time.perf_counter() - start)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        total = sum(times)
+        if (len(times) >= min_repeat and total >= min_time) or total >= max_time:
+            break
+    return {
+        'min': min(times),
+        'median': median(times),
+        'max': max(times),
+        'repeat': len(times),
+    }
+
+
+def run_cases(cases: List[BenchCase], **measure_kwargs) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for case in cases:
+        result = measure(case, **measure_kwargs)
+        logger.info("%s: min %.6fs median %.6fs (%s runs)", case.key, result['min'], result['median'],
+                    result['repeat'])
+        results[case.key] = result
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float = CHANGE_THRESHOLD) -> List[Tuple[str, float, float, float, str]]:
+    """
+    Compare best times of cases present in both reports
+    @return: rows of (case, baseline min, current min, current / baseline, verdict)
+    """
+    rows = []
+    for key, result in current['results'].items():
+        if key not in baseline['results']:
+            continue
+        before = baseline['results'][key]['min']
+        after = result['min']
+        ratio = after / before if before else float('inf')
+        if ratio > 1 + threshold:
+            verdict = 'slower'
+        elif ratio < 1 - threshold:
+            verdict = 'faster'
+        else:
+            verdict = ''
+        rows.append((key, before, after, ratio, verdict))
+    return rows
@@ -0,0 +1,79 @@
+import importlib
+import json
+import logging
+from pathlib import Path
+from typing import List
+
+import click
+
+from benchmarks.bench_startup import ENTRY_POINTS, heavy_imports
+from benchmarks.generators import CROP_SIZES
+from benchmarks.harness import BenchCase, run_cases, environment, compare, MIN_TIME, MAX_TIME
+
+LOGGER = logging.getLogger(__name__)
+
+CELL_SIZES = [10, 100, 1000, 5000]
+QUICK_CELL_SIZES = [10, 100, 1000]
+QUICK_CROPS = ['small', 'half_page']
+
+
+def collect_cases(quick: bool) -> List[BenchCase]:
+    cell_sizes = QUICK_CELL_SIZES if quick else CELL_SIZES
+    crops = [crop for crop in CROP_SIZES if not quick or crop[0] in QUICK_CROPS]
+    suites = [
+        ('benchmarks.bench_geometry', cell_sizes),
+        ('benchmarks.bench_table', cell_sizes),
+        ('benchmarks.bench_image', crops),
+        ('benchmarks.bench_startup', ENTRY_POINTS),
+    ]
+    bench_cases = []
+    for module_name, sizes in suites:
+        # Suite is skipped if part of the pipeline it measures can't be imported, e.g. without opencv
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            LOGGER.warning("Skipping %s: %s", module_name, str(e))
+            continue
+        bench_cases.extend(module.cases(sizes))
+    return bench_cases
+
+
+def print_comparison(baseline: dict, current: dict):
+    click.echo(f"baseline {baseline['environment']['commit']} -> current {current['environment']['commit']}")
+    for key, before, after, ratio, verdict in compare(baseline, current):
+        click.echo(f"{key:<50} {before:>12.6f} {after:>12.6f} {ratio:>7.2f}x {verdict}")
+
+
+@click.command()
+@click.option('--output', type=click.Path(), default=None, help='Save results json to compare with other commits')
+@click.option('--compare', 'baseline', type=click.Path(exists=True), default=None,
+              help='Results json of a baseline commit')
+@click.option('--quick', is_flag=True, help='Skip 5000 cells and full page cases')
+@click.option('--filter', 'name_filter', type=str, default=None, help='Run only cases containing this substring')
+@click.option('--min_time', type=float, default=MIN_TIME, help='Measured seconds per case before it stops repeating')
+@click.option('--max_time', type=float, default=MAX_TIME, help='Measured seconds per case cap for slow cases')
+def run(output, baseline, quick, name_filter, min_time, max_time):
+    """
+    Time geometry, table reconstruction and gap finding kernels on synthetic data and command line startup,
+    no models are needed
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    bench_cases = collect_cases(quick)
+    if name_filter:
+        bench_cases = [case for case in bench_cases if name_filter in case.key]
+    current = {
+        'environment': environment(),
+        'results': run_cases(bench_cases, min_time=min_time, max_time=max_time),
+        'heavy_imports': heavy_imports(),
+    }
+    if output:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if baseline:
+        with open(baseline, 'r') as f:
+            print_comparison(json.load(f), current)
+
+
+if __name__ == "__main__":
+    run()
@@ -3,7 +3,7 @@ import logging
 import numpy
 from dataclasses import asdict
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import cv2
 import numpy as np
@@ -12,6 +12,7 @@ from tqdm import tqdm
 from .models import Image, ImageDTO, InferenceTable
 from ..model.table import BorderBox, Cell
 from .utils import draw_cols_and_rows
+from ..profiling.stage_profiler import profiled
 
 logger = logging.getLogger(__name__)
 
@@ -103,17 +104,25 @@ def detect_images(images: Path, pdf_pages_size: List, draw: bool = True) -> dict
     return {"detections": result}
 
 
-def detect_tables_on_page(image_path: Path, draw=False):
-    mask = cv2.imread(str(image_path.absolute()))
+@profiled('bordered_detection')
+def detect_tables_on_page(image_path: Path, draw=False, img: Optional[np.ndarray] = None):
+    """
+    @param img: page image buffer, image_path is read if not provided
+    """
+    if img is None:
+        mask = cv2.imread(str(image_path.absolute()))
+    else:
+        # Detected boxes are drawn on the mask, page image should stay untouched
+        mask = img.copy() if draw else img
     image = Image(path=image_path, pdf_page_shape=[mask.shape[1], mask.shape[0]])
     image.shape = mask.shape[:2]
 
-    detect_bordered_tables_on_image(image, draw=True, mask=mask)
+    detect_bordered_tables_on_image(image, draw=draw, mask=mask)
 
     image.analyze()
 
     if draw:
-        draw_cols_and_rows(image)
+        draw_cols_and_rows(image, img)
 
     image.scale_bboxes()
     return image
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field
 
+from table_extractor.model.spatial_index import BoxIndex, suppress_overlapping
 from table_extractor.model.table import StructuredTable, BorderBox, TextField, Cell, Table, Row, Column
 from table_extractor.tesseract_service.tesseract_extractor import TextExtractor
 from pathlib import Path
@@ -136,66 +137,33 @@ class InferenceTable:
 
 
 def match_cells_and_tables(raw_cells: List[BorderBox], inference_tables: List[InferenceTable]) -> List[BorderBox]:
-    cells_stack = raw_cells.copy()
-
-    def check_inside_and_put(inf_table: InferenceTable, inf_cell: BorderBox):
-        if inf_cell.box_is_inside_another(inf_table.bbox):
-            inf_table.tags.append(inf_cell)
-            return True
-        return False
+    tables_index = BoxIndex(inference_tables, key=lambda inf_table: inf_table.bbox)
 
     not_matched_cells: List[BorderBox] = []
-    while len(cells_stack) > 0:
-        cell = cells_stack.pop()
-        matched = False
-        for table in inference_tables:
-            matched = matched or check_inside_and_put(table, cell)
-            if matched:
-                break
-        if not matched:
+    # Cells are matched from the last one, every cell goes to the first table containing it
+    for cell in reversed(raw_cells):
+        table = tables_index.first_inside_another(cell)
+        if table is not None:
+            table.tags.append(cell)
+        else:
             not_matched_cells.append(cell)
 
     for table in inference_tables:
-        filtered = []
-        stack = table.tags.copy()
-        while len(stack) > 0:
-            cell = stack.pop()
-            to_remove = []
-            candidates = [cell]
-            for i in range(len(stack)):
-                other_cell = stack[i]
-                if cell.box_is_inside_another(other_cell):
-                    candidates.append(other_cell)
-                    to_remove.append(other_cell)
-            filtered.append(
-                max(candidates, key=lambda c: c.confidence)
-            )
-            for i in to_remove:
-                not_matched_cells.append(i)
-                stack.remove(i)
-        table.tags = filtered
+        table.tags, duplicates = suppress_overlapping(table.tags)
+        not_matched_cells.extend(duplicates)
 
     return not_matched_cells
 
 
 def match_headers_and_tables(headers: List[Cell], inference_tables: List[InferenceTable]) -> List[BorderBox]:
-    headers_stack = headers.copy()
-
-    def check_inside_and_put(inf_table: InferenceTable, inf_header: BorderBox):
-        if inf_header.box_is_inside_another(inf_table.bbox):
-            inf_table.header_boxes.append(inf_header)
-            return True
-        return False
+    tables_index = BoxIndex(inference_tables, key=lambda inf_table: inf_table.bbox)
 
     not_matched_cells: List[BorderBox] = []
-    while len(headers_stack) > 0:
-        cell = headers_stack.pop()
-        matched = False
-        for table in inference_tables:
-            matched = matched or check_inside_and_put(table, cell)
-            if matched:
-                break
-        if not matched:
+    for cell in reversed(headers):
+        table = tables_index.first_inside_another(cell)
+        if table is not None:
+            table.header_boxes.append(cell)
+        else:
             not_matched_cells.append(cell)
 
     return not_matched_cells
@@ -1,4 +1,7 @@
+from typing import Optional
+
 import cv2
+import numpy as np
 
 from .models import Image
 
@@ -8,8 +11,8 @@ ROW_COLOR = (0, 0, 255)
 TABLE_COLOR = (255, 0, 0)
 
 
-def draw_cols_and_rows(image: Image):
-    mask = cv2.imread(str(image.path.absolute()))
+def draw_cols_and_rows(image: Image, img: Optional[np.ndarray] = None):
+    mask = cv2.imread(str(image.path.absolute())) if img is None else img.copy()
     if image.tables is None:
         return
     for table in image.tables:
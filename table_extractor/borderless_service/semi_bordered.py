@@ -10,6 +10,7 @@ import logging
 
 from table_extractor.bordered_service.models import Image, InferenceTable
 from table_extractor.model.table import BorderBox, Cell, Table, Row
+from table_extractor.profiling.stage_profiler import profiled, count
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -28,6 +29,9 @@ ROI_PADDING = 2
 
 CONTOURS_DIM_THRESHOLD = 10
 
+# Pixels of lines scanned by find_gaps at once, bounds memory of cumulative sums
+GAPS_SCAN_BLOCK_PIXELS = 1 << 22
+
 class Axis(int, Enum):
     x = 0
     y = 1
@@ -154,43 +158,42 @@ def draw_boxes(img, boxes, origin=(0, 0), color=(0,255,0), stroke=2):
     return new_img
 
 
-def can_be_a_gap(window: List[float], bg_value, threshold):
-    length = 0
-    for value in window:
-        if value != bg_value:
-            length += 1
-            if length > threshold:
-                return False
-        else:
-            length = 0
-    return True
-
-
-def filter_gaps(gaps_1d: List[bool], threshold):
+def filter_gaps(gaps_1d: List[bool], threshold) -> List[bool]:
+    """
+    Every not gap starts a segment lasting until the next one, segments shorter than threshold are not gaps.
+    Leading gaps make the first segment, the last segment is kept as a gap.
+    """
     # TODO: make adaptive threshold
-    filtered_gaps = []
-    ctr = 0
-    for val in gaps_1d:
-        if val:
-            ctr += 1
-        else:
-            filtered_gaps += [True if ctr >= threshold else False] * ctr
-            ctr = 1
-    else:
-        filtered_gaps += [True] * ctr
-    return filtered_gaps
+    gaps_1d = np.asarray(gaps_1d, dtype=bool)
+    bounds = np.concatenate(([0], np.flatnonzero(~gaps_1d), [gaps_1d.size]))
+    lengths = np.diff(bounds)
+    keep = lengths >= threshold
+    keep[-1] = True
+    return np.repeat(keep, lengths).tolist()
 
 
-def find_gaps(img, axis, bg_value, threshold=3):
+def find_gaps(img, axis, bg_value, threshold=3) -> List[bool]:
+    """
+    Rows (axis 0) or columns (axis 1) of img without runs of over threshold pixels different from bg_value
+    """
     if axis not in (0, 1):
         raise ValueError('Axis value should be either 0 or 1')
-    gaps = []
-    for i in range(img.shape[axis]):
-        # 1d sliding window
-        y_slice, x_slice = (slice(None), slice(i, i+1)) if axis else (slice(i, i+1), slice(None))
-        window = img[y_slice, x_slice].ravel()
-        gaps.append(True if can_be_a_gap(window, bg_value, threshold) else False)
-    return gaps
+    count('pixels_scanned', img.shape[0] * img.shape[1])
+    if img.shape[axis] == 0:
+        return []
+    lines = np.moveaxis(img, axis, 0).reshape(img.shape[axis], -1)
+    run = max(1, math.floor(threshold) + 1)
+    gaps = np.ones(lines.shape[0], dtype=bool)
+    if run > lines.shape[1]:
+        return gaps.tolist()
+    block = max(1, GAPS_SCAN_BLOCK_PIXELS // max(1, lines.shape[1]))
+    for start in range(0, lines.shape[0], block):
+        not_bg = lines[start:start + block] != bg_value
+        # Number of not background pixels in every window of run pixels is a difference of cumulative sums
+        cumsum = np.zeros((not_bg.shape[0], not_bg.shape[1] + 1), dtype=np.int32)
+        np.cumsum(not_bg, axis=1, out=cumsum[:, 1:])
+        gaps[start:start + block] = ~((cumsum[:, run:] - cumsum[:, :-run]) == run).any(axis=1)
+    return gaps.tolist()
 
 
 def gap_to_2d_mask(gaps_1d: List[bool], axis, shape: Tuple[int]):
@@ -394,24 +397,20 @@ def parse_header(roi: TableROI, img):
         return None, None, None
 
 
-def get_pos_of_max_gap(gap_mask):
-    max_gap_center = -1
-    max_ctr = -1
-    ctr = 0
-    start = 0
-    for i, val in enumerate(gap_mask):
-        if val is True:
-            ctr += 1
-        else:
-            if ctr > max_ctr:
-                max_ctr = ctr
-                max_gap_center = (start + i) // 2
-            ctr = 0
-            start = i
-    else:
-        if ctr > max_ctr:
-            max_gap_center = (start + i) // 2
-    return max_gap_center
+def get_pos_of_max_gap(gap_mask) -> int:
+    """
+    Center of the longest run of gaps, a run is measured from the not gap before it, or from the first position,
+    to the not gap after it, or to the last position. The first of equally long runs is taken.
+    """
+    gap_mask = np.asarray(gap_mask, dtype=bool)
+    if not gap_mask.size:
+        return -1
+    not_gaps = np.flatnonzero(~gap_mask)
+    run_lengths = np.diff(np.concatenate(([-1], not_gaps, [gap_mask.size]))) - 1
+    starts = np.concatenate(([0], not_gaps))
+    ends = np.concatenate((not_gaps, [gap_mask.size - 1]))
+    longest = int(np.argmax(run_lengths))
+    return int((starts[longest] + ends[longest]) // 2)
 
 
 def parse_borderless(img):
@@ -436,9 +435,7 @@ def parse_borderless(img):
     mask_array = np.full(table.shape, 0, dtype="int32")
     mask_array[table.mask] = 255
 
-    # FIXME: yes, this is utterly horrible, need more time to deal with type conversions in opencv
-    cv2.imwrite('temp.png', mask_array)
-    mask_array = cv2.imread('temp.png', 0)
+    mask_array = mask_array.astype(np.uint8)
     (thresh, im_bw) = cv2.threshold(mask_array, 127, 255, 0)
     contours, hierarchy = cv2.findContours(im_bw, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
     boxes = contours_to_boxes(img, contours)
@@ -525,9 +522,7 @@ def parse_semi_bordered(img):
     mask_array[table_mask] = 255
     mask_array[:,:10] = 255
 
-    # FIXME: yes, this is utterly horrible, need more time to deal with type conversions in opencv
-    cv2.imwrite('temp.png', mask_array)
-    mask_array = cv2.imread('temp.png', 0)
+    mask_array = mask_array.astype(np.uint8)
     (thresh, im_bw) = cv2.threshold(mask_array, 127, 255, 0)
     contours, hierarchy = cv2.findContours(im_bw, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
     boxes = contours_to_boxes(img, contours)
@@ -582,6 +577,7 @@ def construct_rows_from_boxes(cells: List[Cell], x_max) -> List[Row]:
     return list(h_lines.values())
 
 
+@profiled('semi_bordered')
 def semi_bordered(page_img: np.ndarray, inference_table: InferenceTable) -> Optional[Table]:
     top_left_x = inference_table.bbox.top_left_x
     top_left_y = inference_table.bbox.top_left_y
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Union
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate cached results after changes in pipeline output
+CACHE_VERSION = 1
+DEFAULT_MAX_SIZE_BYTES = 1024 ** 3
+# Eviction frees cache down to this share of max size, so the cache directory is rescanned only occasionally
+EVICTION_LOW_WATER = 0.9
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(str(path.absolute()), 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def config_hash(model_files: List[Path], config: Dict[str, Any]) -> str:
+    """
+    Hash of model checkpoint and config contents plus pipeline parameters which affect page results
+    """
+    return hash_bytes(json.dumps({
+        'version': CACHE_VERSION,
+        'models': [hash_file(path) for path in model_files],
+        'config': config
+    }, sort_keys=True).encode('utf-8'))
+
+
+class PageResultCache:
+    """
+    On disk cache of page_to_dict results keyed by pdf content, page number and pipeline config.
+    Least recently used entries are evicted down to EVICTION_LOW_WATER of max_size_bytes
+    when cache grows over max_size_bytes.
+    Entries are written atomically, so the cache directory can be shared between worker processes.
+    Size is tracked per process and re-read from disk on eviction only, so with parallel workers writing
+    to the same directory max_size_bytes is approximate: cache may grow up to about workers * max_size_bytes.
+    """
+    def __init__(self, cache_dir: Path, config_key: str, max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES):
+        self.cache_dir = cache_dir
+        self.config_key = config_key
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._size = sum(path.stat().st_size for path in self._entries())
+
+    def _entries(self) -> List[Path]:
+        return list(self.cache_dir.glob("*/*.json"))
+
+    def _path(self, pdf_hash: str, page_num: int) -> Path:
+        key = hash_bytes(f"{pdf_hash}:{page_num}:{self.config_key}".encode('utf-8'))
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, pdf_hash: str, page_num: int) -> Optional[Dict[str, Any]]:
+        path = self._path(pdf_hash, page_num)
+        try:
+            with open(str(path.absolute()), 'r') as f:
+                page = json.load(f)
+            # Modification time is used as last access time for LRU eviction
+            os.utime(str(path.absolute()))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        logger.debug("Cache hit for page %s of %s", page_num, pdf_hash)
+        return page
+
+    def put(self, pdf_hash: str, page_num: int, page: Dict[str, Any]):
+        path = self._path(pdf_hash, page_num)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(page).encode('utf-8')
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(str(tmp_path.absolute()), 'wb') as f:
+            f.write(data)
+        try:
+            replaced_size = path.stat().st_size
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(str(tmp_path.absolute()), str(path.absolute()))
+        with self._lock:
+            self._size += len(data) - replaced_size
+            if self._size > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        self._size = sum(size for _, size, _ in entries)
+        low_water = int(self.max_size_bytes * EVICTION_LOW_WATER)
+        for _, size, path in sorted(entries, key=lambda x: x[0]):
+            if self._size <= low_water:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self._size -= size
+        logger.debug("Cache size after eviction: %s bytes", self._size)
+
+
+def hash_pdf(pdf: Union[Path, bytes]) -> str:
+    return hash_bytes(pdf) if isinstance(pdf, bytes) else hash_file(pdf)
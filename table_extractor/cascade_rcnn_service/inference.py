@@ -1,13 +1,19 @@
 import logging
 from pathlib import Path
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Tuple, Optional, TYPE_CHECKING
 
 import cv2
+import numpy as np
 
 from table_extractor.bordered_service.models import InferenceTable, match_cells_and_tables, match_headers_and_tables
+from table_extractor.model.spatial_index import suppress_overlapping
 from table_extractor.model.table import BorderBox, Cell
 from table_extractor.cascade_rcnn_service.utils import extract_boxes_from_result, has_image_extension
-from mmdet.apis import init_detector, inference_detector
+
+if TYPE_CHECKING:
+    from mmdet.datasets.pipelines import Compose
+
+# torch, mmcv and mmdet are imported by the methods using them, importing them takes seconds
 
 CLASS_NAMES = ('Bordered', 'Cell', 'Borderless', 'Header', 'Table_annotation')
 DEFAULT_THRESHOLD = 0.3
@@ -17,22 +23,7 @@ logger = logging.getLogger(__name__)
 
 
 def _filter_double_detection(inference_tables: List[InferenceTable]):
-    filtered = []
-    stack = inference_tables.copy()
-    while len(stack) > 0:
-        table = stack.pop()
-        to_remove = []
-        candidates = [table]
-        for i in range(len(stack)):
-            other_table = stack[i]
-            if table.bbox.box_is_inside_another(other_table.bbox):
-                candidates.append(other_table)
-                to_remove.append(other_table)
-        filtered.append(
-            max(candidates, key=lambda c: c.confidence)
-        )
-        for i in to_remove:
-            stack.remove(i)
+    filtered, _ = suppress_overlapping(inference_tables, key=lambda inf_table: inf_table.bbox)
     return filtered
 
 
@@ -76,21 +67,76 @@ def inference_result_to_boxes(inference_page_result: List[Dict[str, Any]]) \
 
 
 class CascadeRCNNInferenceService:
-    def __init__(self, config: Path, model: Path, should_visualize: bool = False):
+    def __init__(self, config: Path, model: Path, should_visualize: bool = False, num_threads: Optional[int] = None):
+        import torch
+        from mmdet.apis import init_detector
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
         self.model = init_detector(str(config.absolute()), str(model.absolute()), device='cpu')
         self.should_visualize = should_visualize
-
-    def inference_image(self, img: Path, threshold: float = DEFAULT_THRESHOLD):
+        self._batch_pipeline = None
+
+    def _visualize(self, img: Path, source, result):
+        inference_image = self.model.show_result(source, result)
+        image_path = img.parent.parent / "raw_model" / img.name
+        image_path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(image_path.absolute()), inference_image)
+
+    def inference_image(self, img: Path, threshold: float = DEFAULT_THRESHOLD, image: Optional[np.ndarray] = None):
+        """
+        @param img: path of page image, used only for naming visualization results if image is provided
+        @param image: page image buffer to run inference on instead of reading img from disk
+        """
         if not has_image_extension(img):
             logger.warning(f'Not image {img}')
             return
+        from mmdet.apis import inference_detector
+
         logger.info(f'Cascade inference image {img}')
-        result = inference_detector(self.model, img)
+        source = image if image is not None else img
+        result = inference_detector(self.model, source)
         if self.should_visualize:
-            inference_image = self.model.show_result(img, result)
-            image_path = img.parent.parent / "raw_model" / img.name
-            image_path.parent.mkdir(parents=True, exist_ok=True)
-            cv2.imwrite(str(image_path.absolute()), inference_image)
+            self._visualize(img, source, result)
         inf_tables, headers, _ = inference_result_to_boxes(
             extract_boxes_from_result(result, CLASS_NAMES, score_thr=threshold))
         return inf_tables, headers
+
+    def _get_batch_pipeline(self) -> "Compose":
+        from mmdet.datasets import replace_ImageToTensor
+        from mmdet.datasets.pipelines import Compose
+
+        if self._batch_pipeline is None:
+            cfg = self.model.cfg.copy()
+            cfg.data.test.pipeline[0].type = 'LoadImageFromWebcam'
+            cfg.data.test.pipeline = replace_ImageToTensor(cfg.data.test.pipeline)
+            self._batch_pipeline = Compose(cfg.data.test.pipeline)
+        return self._batch_pipeline
+
+    def inference_batch(self,
+                        images_paths: List[Path],
+                        images: List[np.ndarray],
+                        threshold: float = DEFAULT_THRESHOLD) -> List[Tuple[List[InferenceTable], List[Cell]]]:
+        """
+        Run single forward pass over several page images, result for every image is the same as of inference_image
+        @param images_paths: paths of page images, used only for naming visualization results
+        """
+        import torch
+        from mmcv.parallel import collate
+
+        logger.info(f'Cascade inference batch of {len(images)} images')
+        test_pipeline = self._get_batch_pipeline()
+        data = collate([test_pipeline(dict(img=image)) for image in images], samples_per_gpu=len(images))
+        # Get the actual data from DataContainer, images are padded to the same shape by collate
+        data['img_metas'] = [img_metas.data[0] for img_metas in data['img_metas']]
+        data['img'] = [img.data[0] for img in data['img']]
+        with torch.no_grad():
+            results = self.model(return_loss=False, rescale=True, **data)
+        boxes = []
+        for img, image, result in zip(images_paths, images, results):
+            if self.should_visualize:
+                self._visualize(img, image, result)
+            inf_tables, headers, _ = inference_result_to_boxes(
+                extract_boxes_from_result(result, CLASS_NAMES, score_thr=threshold))
+            boxes.append((inf_tables, headers))
+        return boxes
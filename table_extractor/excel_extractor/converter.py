@@ -1,4 +1,5 @@
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, TYPE_CHECKING
 from table_extractor.model.table import (
     StructuredTable,
     StructuredTableHeadered,
@@ -6,10 +7,18 @@ from table_extractor.model.table import (
     CellLinked,
     TextField
 )
-from table_extractor.headers.header_utils import HeaderChecker
 from openpyxl.cell.cell import Cell
 
-header_checker = HeaderChecker()
+if TYPE_CHECKING:
+    from table_extractor.headers.header_utils import HeaderChecker
+
+
+@lru_cache(maxsize=None)
+def get_header_checker() -> "HeaderChecker":
+    # nltk and header dictionaries are loaded on first analysed table, not on import of excel extractor
+    from table_extractor.headers.header_utils import HeaderChecker
+
+    return HeaderChecker()
 
 
 def should_skip_attr(cells: Dict[tuple, tuple], cell: Cell, another_cell: Cell, key, style) -> bool:
@@ -99,7 +108,7 @@ def analyse(series: List[CellLinked]):
     # Check if series is header
     headers = []
     for cell in series:
-        header_score, _ = header_checker.get_cell_score(cell)
+        header_score, _ = get_header_checker().get_cell_score(cell)
         if header_score > 0:
             headers.append(cell)
     return len(headers) > (len(series) / 5) if len(series) > 5 else len(headers) > (len(series) / 2)
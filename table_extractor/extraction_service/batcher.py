@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from dataclasses import dataclass
+
+if TYPE_CHECKING:
+    from table_extractor.cascade_rcnn_service.inference import CascadeRCNNInferenceService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = 4
+DEFAULT_MAX_WAIT_MS = 50
+
+
+@dataclass
+class InferenceRequest:
+    image_path: Path
+    img: np.ndarray
+    future: Future
+
+
+class InferenceBatcher:
+    """
+    Gathers page images submitted from concurrent requests into micro-batches for Cascade inference.
+    Batch is run as soon as max_batch_size images are waiting or max_wait_ms passed since the first of them arrived.
+    """
+    def __init__(self,
+                 inference_service: "CascadeRCNNInferenceService",
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms: int = DEFAULT_MAX_WAIT_MS):
+        self.inference_service = inference_service
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, image_path: Path, img: np.ndarray) -> Future:
+        future = Future()
+        self._queue.put(InferenceRequest(image_path, img, future))
+        return future
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _collect_batch(self) -> List[InferenceRequest]:
+        try:
+            batch = [self._queue.get(timeout=self.max_wait)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            try:
+                results = self._inference(batch)
+            except Exception as e:
+                logger.warning("Batch inference failed: %s", str(e))
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+    def _inference(self, batch: List[InferenceRequest]) -> List[Tuple]:
+        if len(batch) == 1:
+            return [self.inference_service.inference_image(batch[0].image_path, image=batch[0].img)]
+        return self.inference_service.inference_batch([request.image_path for request in batch],
+                                                      [request.img for request in batch])
@@ -0,0 +1,176 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from table_extractor.cache_service.result_cache import hash_pdf
+from table_extractor.extraction_service.batcher import InferenceBatcher
+from table_extractor.pipeline.pipeline import PageProcessor
+from table_extractor.poppler_service.poppler_text_extractor import open_document_from_data, extract_page_text
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 1000
+
+
+class LatencyStats:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests_total = 0
+        self.requests_failed = 0
+        self.requests_in_flight = 0
+
+    def start(self):
+        with self._lock:
+            self.requests_in_flight += 1
+
+    def finish(self, latency: float, failed: bool = False):
+        with self._lock:
+            self.requests_in_flight -= 1
+            self.requests_total += 1
+            if failed:
+                self.requests_failed += 1
+            else:
+                self._latencies.append(latency)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                'requests_total': self.requests_total,
+                'requests_failed': self.requests_failed,
+                'requests_in_flight': self.requests_in_flight,
+            }
+        if latencies:
+            stats['latency_seconds'] = {
+                'last': latencies[-1],
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95)),
+            }
+        return stats
+
+
+class ExtractionService:
+    """
+    Keeps models warm between requests, Cascade inference of pages from concurrent requests is micro-batched
+    """
+    def __init__(self, page_processor: PageProcessor, batcher: InferenceBatcher, work_dir: Path):
+        self.page_processor = page_processor
+        self.batcher = batcher
+        self.work_dir = work_dir
+        self.stats = LatencyStats()
+
+    def _submit_page(self, pdf_document, page_num: int, images_path: Path) -> Tuple[Path, np.ndarray, Future]:
+        image_path, img = self.page_processor.render_page(pdf_document, page_num, images_path)
+        return image_path, img, self.batcher.submit(image_path, img)
+
+    def extract(self, pdf_data: bytes, doc_name: str) -> Dict[str, Any]:
+        self.stats.start()
+        start = time.perf_counter()
+        try:
+            pdf_document = open_document_from_data(pdf_data)
+            document_hash = hash_pdf(pdf_data) if self.page_processor.result_cache else None
+            images_path = self.work_dir / uuid.uuid4().hex / doc_name / 'images'
+            # Keep only a batch worth of rendered pages waiting for inference
+            in_flight = deque()
+            pages: List[Dict[str, Any]] = []
+            next_page = 0
+            while next_page < pdf_document.pages or in_flight:
+                while next_page < pdf_document.pages and len(in_flight) < self.batcher.max_batch_size:
+                    cached_page = self.page_processor.get_cached_page(document_hash, next_page)
+                    if cached_page is not None:
+                        in_flight.append((next_page, cached_page))
+                    else:
+                        in_flight.append((next_page, self._submit_page(pdf_document, next_page, images_path)))
+                    next_page += 1
+                page_num, task = in_flight.popleft()
+                if isinstance(task, dict):
+                    pages.append(task)
+                    continue
+                image_path, img, future = task
+                page = self.page_processor.process_page(image_path,
+                                                        images_path.parent,
+                                                        extract_page_text(pdf_document, page_num),
+                                                        inference_result=future.result(),
+                                                        img=img)
+                self.page_processor.cache_page(document_hash, page_num, page)
+                pages.append(page)
+        except Exception:
+            self.stats.finish(time.perf_counter() - start, failed=True)
+            raise
+        latency = time.perf_counter() - start
+        self.stats.finish(latency)
+        logger.info("Document %s with %s pages processed in %.3f s", doc_name, len(pages), latency)
+        return {
+            'doc_name': doc_name,
+            'pages': pages
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.stats.to_dict()
+        stats['inference_queue_depth'] = self.batcher.queue_depth
+        ocr_cache = self.page_processor.ocr_pool.ocr_cache
+        if ocr_cache is not None:
+            stats['ocr_cache'] = ocr_cache.stats()
+        return stats
+
+
+def _make_handler(service: ExtractionService):
+    class ExtractionRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: Dict[str, Any]):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if urlparse(self.path).path == '/stats':
+                self._send_json(200, service.get_stats())
+            else:
+                self._send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/extract':
+                self._send_json(404, {'error': 'Not found'})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            if not length:
+                self._send_json(400, {'error': 'Pdf document is expected in request body'})
+                return
+            doc_name = parse_qs(url.query).get('name', ['document.pdf'])[0]
+            pdf_data = self.rfile.read(length)
+            try:
+                document = service.extract(pdf_data, Path(doc_name).name)
+            except Exception as e:
+                logger.warning("Extraction of %s failed: %s", doc_name, str(e))
+                self._send_json(500, {'error': str(e)})
+                return
+            self._send_json(200, document)
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return ExtractionRequestHandler
+
+
+def serve(service: ExtractionService, host: str, port: int):
+    server = ThreadingHTTPServer((host, port), _make_handler(service))
+    logger.info("Extraction service is listening on %s:%s", host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.batcher.close()
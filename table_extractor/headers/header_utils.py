@@ -1,22 +1,28 @@
 import json
 import string
-from typing import Tuple, List
+from typing import Tuple, List, Set
 from pathlib import Path
 import nltk
 from nltk.stem import WordNetLemmatizer
-from nltk.corpus import words, stopwords
+from nltk.corpus import stopwords
 from table_extractor.model.table import CellLinked
 import regex
 import numpy as np
-from functools import reduce
+from functools import reduce, lru_cache
 
 stemmer = WordNetLemmatizer()
-stop_list = set(stopwords.words('english'))
-word_list = set(words.words())
 SPECIAL_CHARACTERS_REGEX = regex.compile('[%=]+')
 NUMBER_REGEX = regex.compile('([0-9]+\\.[0-9]+)')
 
 
+@lru_cache(maxsize=None)
+def get_stop_list() -> Set[str]:
+    """
+    English stopwords, corpus is loaded on first call instead of module import
+    """
+    return set(stopwords.words('english'))
+
+
 def softmax(array: Tuple[float]) -> List[float]:
     x = np.array(array)
     e_x = np.exp(x - np.max(x))
@@ -90,7 +96,7 @@ class HeaderChecker:
         header_probability = 0
         cell_probability = 0
 
-        if word in stop_list:
+        if word in get_stop_list():
             return 0, 0
         if word in self.header_words.keys():
             header_probability += self.header_words[word]['probability']
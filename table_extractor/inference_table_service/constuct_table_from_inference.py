@@ -1,30 +1,26 @@
 import logging
 from typing import List, Tuple, Dict, Optional
 
-from table_extractor.model.table import GridCell, GridRow, GridCol, GridTable, CellLinked, StructuredTable, BorderBox, \
-    Cell
+import numpy as np
+
+from table_extractor.model.table import GridCell, CellLinked, StructuredTable, BorderBox, Cell, ImplicitGridTable
+from table_extractor.model.spatial_index import GridIndex
+
+from table_extractor.profiling.stage_profiler import profiled, count
 
 LOGGER = logging.getLogger(__name__)
 
 
-def _match_cells_and_table(table: GridTable, cells: List[Cell]):
+def _match_cells_and_table(table: ImplicitGridTable, cells: List[Cell]):
     not_matched = []
+    grid_index = GridIndex(table)
     for cell in cells:
-        row_num = None
-        for r_idx, row in enumerate(table.rows):
-            if row.box_is_inside_another(cell):
-                row_num = r_idx
-                break
-        col_num = None
-        for c_idx, col in enumerate(table.cols):
-            if col.box_is_inside_another(cell):
-                col_num = c_idx
-                break
+        row_num = grid_index.first_row_inside(cell)
+        col_num = grid_index.first_col_inside(cell)
         if row_num is not None and col_num is not None:
-            g_cell = table.cells[row_num * len(table.cols) + col_num]
+            g_cell = table.assign(row_num, col_num, cell)
             if not g_cell.box_is_inside_another(cell):
                 not_matched.append(cell)
-            g_cell.cells.append(cell)
         else:
             not_matched.append(cell)
 
@@ -45,19 +41,36 @@ def _merge_closest_cells(g_cells: List[GridCell]):
         g_cell.cells = new_cells
 
 
-def _find_gaps_in_zone(line: List[bool], zone: Tuple[int, int]) -> List[List[int]]:
-    gaps = []
-    curr_gap = []
-    for point_idx in range(zone[0], zone[1]):
-        if line[point_idx] and curr_gap:
-            curr_gap.append(point_idx - 1)
-            gaps.append(curr_gap)
-            curr_gap = []
-        if not line[point_idx] and not curr_gap:
-            curr_gap.append(point_idx)
-    if curr_gap:
-        curr_gap.append(zone[1])
-        gaps.append(curr_gap)
+def _clip_zone(zone: Tuple[int, int], size: int) -> Tuple[int, int]:
+    # Points outside of the image are never covered by cells
+    return max(0, zone[0]), min(zone[1], size)
+
+
+def _projection(starts: np.ndarray, ends: np.ndarray, zone: Tuple[int, int]) -> np.ndarray:
+    """
+    Points of zone[0]..zone[1] - 1 covered by any of starts[i]..ends[i] ranges, borders included
+    """
+    size = max(0, zone[1] - zone[0])
+    starts = np.clip(starts - zone[0], 0, size)
+    ends = np.clip(ends - zone[0] + 1, 0, size)
+    keep = starts < ends
+    delta = np.bincount(starts[keep], minlength=size + 1) - np.bincount(ends[keep], minlength=size + 1)
+    return np.cumsum(delta[:size]) > 0
+
+
+def _find_gaps_in_zone(covered: np.ndarray, zone: Tuple[int, int]) -> List[List[int]]:
+    """
+    Runs of not covered points of zone as [first point, last point], a run reaching the end of zone ends at zone[1]
+    @param covered: projection of zone, covered[i] tells if point zone[0] + i is covered by cells
+    """
+    if not covered.size:
+        return []
+    edges = np.diff(np.concatenate(([0], (~covered).view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    gaps = [[zone[0] + int(start), zone[0] + int(end)] for start, end in zip(starts, ends)]
+    if gaps and ends[-1] == covered.size - 1:
+        gaps[-1][1] = zone[1]
     return gaps
 
 
@@ -65,105 +78,54 @@ def _get_line_coord_from_gaps(gaps: List[List[int]]) -> List[int]:
     return [(gap[0] + gap[1]) // 2 for gap in gaps]
 
 
-def find_grid_table(h_lines, v_lines) -> GridTable:
-    cells: List[GridCell] = []
-    rows: List[GridRow] = []
-    cols: List[GridCol] = []
-    prev_h_line = h_lines[0]
-    for h_idx, h_line in enumerate(h_lines[1:]):
-        if h_idx >= len(rows):
-            curr_row = GridRow(
-                top_left_x=v_lines[0],
-                top_left_y=prev_h_line,
-                bottom_right_x=v_lines[-1],
-                bottom_right_y=h_line
-            )
-            rows.append(curr_row)
-        else:
-            curr_row = rows[h_idx]
-
-        prev_v_line = v_lines[0]
-        for v_idx, v_line in enumerate(v_lines[1:]):
-            if v_idx >= len(cols):
-                curr_col = GridCol(
-                    top_left_x=prev_v_line,
-                    top_left_y=h_lines[0],
-                    bottom_right_x=v_line,
-                    bottom_right_y=h_lines[-1]
-                )
-                cols.append(curr_col)
-            else:
-                curr_col = cols[v_idx]
-            cell = GridCell(
-                top_left_x=prev_v_line,
-                bottom_right_x=v_line,
-                top_left_y=prev_h_line,
-                bottom_right_y=h_line,
-                row=h_idx,
-                col=v_idx
-            )
-            curr_row.g_cells.append(cell)
-            curr_col.g_cells.append(cell)
-            cells.append(cell)
-            prev_v_line = v_line
-        prev_h_line = h_line
-    grid_table = GridTable(
-        rows=rows,
-        cols=cols,
-        cells=cells
-    )
-    return grid_table
-
-
 def _find_lines(table_bbox: BorderBox, cells: List[Cell], image_shape: Tuple[int, int]):
+    """
+    Lines in the middle of gaps between projections of cells on the sides of table_bbox
+    """
     if not cells:
         return [], []
-    h_proj = [False for _ in range(0, image_shape[1])]
-    v_proj = [False for _ in range(0, image_shape[0])]
-
-    for cell in cells:
-        h_proj[cell.top_left_x:cell.bottom_right_x + 1] = \
-            [True for _ in range(cell.top_left_x, cell.bottom_right_x + 1)]
-        v_proj[cell.top_left_y:cell.bottom_right_y + 1] = \
-            [True for _ in range(cell.top_left_y, cell.bottom_right_y + 1)]
+    coords = np.array([cell.box for cell in cells], dtype=np.int64).reshape(-1, 4)
 
-    v_gaps = _find_gaps_in_zone(h_proj, (table_bbox.top_left_x, table_bbox.bottom_right_x))
+    zone = _clip_zone((table_bbox.top_left_x, table_bbox.bottom_right_x), image_shape[1])
+    v_gaps = _find_gaps_in_zone(_projection(coords[:, 0], coords[:, 2], zone), zone)
     v_line_coords = _get_line_coord_from_gaps(v_gaps)
 
-    h_gaps = _find_gaps_in_zone(v_proj, (table_bbox.top_left_y, table_bbox.bottom_right_y))
+    zone = _clip_zone((table_bbox.top_left_y, table_bbox.bottom_right_y), image_shape[0])
+    h_gaps = _find_gaps_in_zone(_projection(coords[:, 1], coords[:, 3], zone), zone)
     h_line_coords = _get_line_coord_from_gaps(h_gaps)
     return h_line_coords, v_line_coords
 
 
-def _actualize_line_separators(table: GridTable, image_shape: Tuple[int, int]) -> Tuple[List[int], List[int]]:
+def _actualize_line_separators(table: ImplicitGridTable, image_shape: Tuple[int, int]) \
+        -> Tuple[List[int], List[int]]:
     span_candidates: Dict[int, GridCell] = {}
-    for g_cell in table.cells:
+    for g_cell in table.occupied():
         if len(g_cell.cells) > 1:
-            span_candidates[len(table.cols) * g_cell.row + g_cell.col] = g_cell
+            span_candidates[table.slot(g_cell.row, g_cell.col)] = g_cell
 
     if not span_candidates:
         return [], []
 
     col_candidates = {}
     for g_cell in span_candidates.values():
-        col_candidates[g_cell.col] = table.cols[g_cell.col]
+        col_candidates[g_cell.col] = table.col_cells(g_cell.col)
 
     row_candidates = {}
     for g_cell in span_candidates.values():
-        row_candidates[g_cell.row] = table.rows[g_cell.row]
+        row_candidates[g_cell.row] = table.row_cells(g_cell.row)
 
     v_lines_to_add = []
     h_lines_to_add = []
     for cand_col in col_candidates.values():
         v_lines = []
-        for g_cell in cand_col.g_cells:
+        for g_cell in cand_col:
             _, v_cell_lines = _find_lines(g_cell, g_cell.cells, image_shape)
             if v_cell_lines:
                 min_v_cells = min([cell.top_left_x for cell in g_cell.cells])
                 max_v_cells = max([cell.bottom_right_x for cell in g_cell.cells])
                 v_cell_lines = list(filter(lambda line: min_v_cells < line < max_v_cells, v_cell_lines))
             v_lines.append(v_cell_lines)
-        g_cell_v_line = list(zip(cand_col.g_cells, v_lines))
+        g_cell_v_line = list(zip(cand_col, v_lines))
         cand_v_sort = list(filter(lambda x: x[3], sorted([(idx, len(v_cell_lines), g_cell, v_cell_lines)
                                                          for idx, (g_cell, v_cell_lines) in enumerate(g_cell_v_line)],
                                                          key=lambda x: x[2].top_left_y)))
@@ -204,14 +166,14 @@ def _actualize_line_separators(table: GridTable, image_shape: Tuple[int, int]) -
 
     for cand_row in row_candidates.values():
         h_lines = []
-        for g_cell in cand_row.g_cells:
+        for g_cell in cand_row:
             h_cell_lines, _ = _find_lines(g_cell, g_cell.cells, image_shape)
             if h_cell_lines:
                 min_h_cells = min([cell.top_left_y for cell in g_cell.cells])
                 max_h_cells = max([cell.bottom_right_y for cell in g_cell.cells])
                 h_cell_lines = list(filter(lambda line: min_h_cells < line < max_h_cells, h_cell_lines))
             h_lines.append(h_cell_lines)
-        g_cell_h_line = list(zip(cand_row.g_cells, h_lines))
+        g_cell_h_line = list(zip(cand_row, h_lines))
         cand_h_sort = sorted([(idx, len(h_cell_lines), g_cell, h_cell_lines)
                               for idx, (g_cell, h_cell_lines) in enumerate(g_cell_h_line)],
                              key=lambda x: (x[1], x[2].top_left_y))
@@ -252,22 +214,18 @@ def _actualize_line_separators(table: GridTable, image_shape: Tuple[int, int]) -
     return list(set(v_lines_to_add)), list(set(h_lines_to_add))
 
 
-def reconstruct_table_from_grid(grid_table: GridTable, cells: List[Cell])\
+def reconstruct_table_from_grid(grid_table: ImplicitGridTable, cells: List[Cell])\
         -> Tuple[Optional[StructuredTable], List[Cell]]:
+    """
+    Cells spanning grid rows and columns they overlap, grid slots not covered by cells become empty cells
+    """
     not_matched = []
     linked_cells = []
-    grid_cells_dict = {}
-    for g_cell in grid_table.cells:
-        grid_cells_dict[g_cell.row * len(grid_table.cols) + g_cell.col] = g_cell
+    free_slots = np.ones((len(grid_table.rows), len(grid_table.cols)), dtype=bool)
+    grid_index = GridIndex(grid_table)
     for cell in cells:
-        rows = []
-        for r_idx, row in enumerate(grid_table.rows):
-            if row.box_is_inside_another(cell, 0.0):
-                rows.append((r_idx, row))
-        cols = []
-        for c_idx, col in enumerate(grid_table.cols):
-            if col.box_is_inside_another(cell, 0.0):
-                cols.append((c_idx, col))
+        rows = [(r_idx, grid_table.rows[r_idx]) for r_idx in grid_index.rows_inside(cell, 0.0)]
+        cols = [(c_idx, grid_table.cols[c_idx]) for c_idx in grid_index.cols_inside(cell, 0.0)]
         if rows and cols:
             linked_cells.append(CellLinked(
                 top_left_y=rows[0][1].top_left_y,
@@ -280,26 +238,25 @@ def reconstruct_table_from_grid(grid_table: GridTable, cells: List[Cell])\
                 col_span=len(cols),
                 text_boxes=cell.text_boxes,
             ))
-            for row in rows:
-                for col in cols:
-                    if grid_cells_dict.get(row[0] * len(grid_table.cols) + col[0]):
-                        _ = grid_cells_dict.pop(row[0] * len(grid_table.cols) + col[0])
+            free_slots[np.ix_([row[0] for row in rows], [col[0] for col in cols])] = False
         else:
             not_matched.append(cell)
-    for _, g_cell in grid_cells_dict.items():
+    for row_num, col_num in np.argwhere(free_slots).tolist():
+        row, col = grid_table.rows[row_num], grid_table.cols[col_num]
         linked_cells.append(CellLinked(
-            top_left_y=g_cell.top_left_y,
-            top_left_x=g_cell.top_left_x,
-            bottom_right_y=g_cell.bottom_right_y,
-            bottom_right_x=g_cell.bottom_right_x,
-            row=g_cell.row,
-            col=g_cell.col,
+            top_left_y=row.top_left_y,
+            top_left_x=col.top_left_x,
+            bottom_right_y=row.bottom_right_y,
+            bottom_right_x=col.bottom_right_x,
+            row=row_num,
+            col=col_num,
             row_span=1,
             col_span=1,
             text_boxes=[],
         ))
-    if not grid_table.cols or not grid_table.rows or not grid_table.cells:
+    if not grid_table.cols or not grid_table.rows:
         return None, cells
+    count('cells_built', len(linked_cells))
     table = StructuredTable(
         bbox=BorderBox(
             top_left_y=grid_table.rows[0].top_left_y,
@@ -312,6 +269,7 @@ def reconstruct_table_from_grid(grid_table: GridTable, cells: List[Cell])\
     return table, not_matched
 
 
+@profiled('construct_table')
 def construct_table_from_cells(table_bbox: BorderBox,
                                cells: List[Cell],
                                image_shape: Tuple[int, int]) -> Optional[StructuredTable]:
@@ -327,7 +285,7 @@ def construct_table_from_cells(table_bbox: BorderBox,
     elif len(v_lines) == 1:
         v_lines = [table_bbox.top_left_x] + v_lines + [table_bbox.bottom_right_x]
 
-    grid_table = find_grid_table(h_lines, v_lines)
+    grid_table = ImplicitGridTable(h_lines, v_lines)
 
     while True:
         _match_cells_and_table(grid_table, cells)
@@ -336,7 +294,7 @@ def construct_table_from_cells(table_bbox: BorderBox,
             break
         h_lines.extend(hh_lines)
         v_lines.extend(vv_lines)
-        grid_table = find_grid_table(sorted(h_lines), sorted(v_lines))
+        grid_table = ImplicitGridTable(sorted(h_lines), sorted(v_lines))
 
     table, _ = reconstruct_table_from_grid(grid_table, cells)
     if _:
@@ -0,0 +1,72 @@
+from typing import Sequence
+
+import numpy as np
+
+from table_extractor.model.table import BorderBox
+from table_extractor.profiling.stage_profiler import count
+
+# Rows of pairwise matrices computed at once, bounds memory of intermediate N x M arrays
+BLOCK_ROWS = 1024
+# Profiler counter of box pairs checked for containment
+CONTAINMENT_COUNTER = 'box_is_inside_another'
+
+
+def _wide(coords: np.ndarray) -> np.ndarray:
+    # Products of int32 coordinates overflow for large boxes
+    return coords.astype(np.int64) if coords.dtype == np.int32 else coords
+
+
+class BoxArray:
+    """
+    N x 4 array of (top_left_x, top_left_y, bottom_right_x, bottom_right_y) boxes with pairwise
+    BorderBox.get_boxes_intersection_area and BorderBox.box_is_inside_another computed for all pairs at once
+    """
+    def __init__(self, coords: np.ndarray):
+        self.coords = coords
+
+    @classmethod
+    def from_boxes(cls, boxes: Sequence[BorderBox]) -> "BoxArray":
+        coords = np.array([box.box for box in boxes], dtype=np.float64).reshape(-1, 4)
+        # Pipeline boxes have integer coordinates, other ones are kept as they are to compare them exactly
+        if np.array_equal(coords, np.floor(coords)) and np.abs(coords).max(initial=0) < 2 ** 31:
+            coords = coords.astype(np.int32)
+        return cls(coords)
+
+    def __len__(self):
+        return self.coords.shape[0]
+
+    @property
+    def areas(self) -> np.ndarray:
+        coords = _wide(self.coords)
+        return (coords[:, 2] - coords[:, 0] + 1) * (coords[:, 3] - coords[:, 1] + 1)
+
+    def intersection_area(self, other: "BoxArray") -> np.ndarray:
+        """
+        N x M intersection areas, borders are included like in BorderBox.get_boxes_intersection_area
+        """
+        first = _wide(self.coords)
+        second = _wide(other.coords)
+        x_left = np.maximum(first[:, None, 0], second[None, :, 0])
+        y_top = np.maximum(first[:, None, 1], second[None, :, 1])
+        x_right = np.minimum(first[:, None, 2], second[None, :, 2])
+        y_bottom = np.minimum(first[:, None, 3], second[None, :, 3])
+        area = (x_right - x_left + 1) * (y_bottom - y_top + 1)
+        return np.where((x_right < x_left) | (y_bottom < y_top), 0, area)
+
+    def inside_another(self, other: "BoxArray", threshold: float = 0.9) -> np.ndarray:
+        """
+        N x M matrix of self[i].box_is_inside_another(other[j], threshold)
+        """
+        result = np.zeros((len(self), len(other)), dtype=bool)
+        if not len(self) or not len(other):
+            return result
+        count(CONTAINMENT_COUNTER, len(self) * len(other))
+        other_areas = other.areas.astype(np.float64)
+        for start in range(0, len(self), BLOCK_ROWS):
+            block = BoxArray(self.coords[start:start + BLOCK_ROWS])
+            intersection = block.intersection_area(other).astype(np.float64)
+            areas = block.areas.astype(np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inside = (intersection / areas[:, None] > threshold) | (intersection / other_areas[None, :] > threshold)
+            result[start:start + BLOCK_ROWS] = (intersection != 0) & inside
+        return result
@@ -0,0 +1,185 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import List, Tuple, Sequence, Optional, Dict, Generic, TypeVar, Callable
+
+import numpy as np
+
+from table_extractor.model.box_array import BoxArray, CONTAINMENT_COUNTER
+from table_extractor.model.table import BorderBox, ImplicitGridTable
+from table_extractor.profiling.stage_profiler import count
+
+T = TypeVar('T')
+
+# Grid cells smaller than this make large boxes span too many grid cells
+MIN_GRID_CELL_SIZE = 16
+
+
+class BoxIndex(Generic[T]):
+    """
+    Uniform grid over boxes of items answering which items overlap a box.
+    Results keep insertion order of items, so replacing a loop over items with a query
+    returns the same items in the same order.
+    Boxes overlap if their borders intersect like in BorderBox.get_boxes_intersection_area,
+    boxes touching by border overlap.
+    """
+    def __init__(self, items: Sequence[T], key: Callable[[T], BorderBox] = lambda item: item,
+                 cell_size: Optional[int] = None):
+        """
+        @param key: box of item
+        @param cell_size: grid cell size, mean box size if not set
+        """
+        self.items = list(items)
+        self.boxes: List[BorderBox] = [key(item) for item in self.items]
+        if cell_size is None:
+            sizes = [max(box.width, box.height) for box in self.boxes]
+            cell_size = int(sum(sizes) / len(sizes)) if sizes else MIN_GRID_CELL_SIZE
+        self.cell_size = max(MIN_GRID_CELL_SIZE, cell_size)
+        self._grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._alive = [True] * len(self.items)
+        for idx, box in enumerate(self.boxes):
+            for grid_key in self._grid_keys(box):
+                self._grid[grid_key].append(idx)
+
+    def __len__(self):
+        return sum(self._alive)
+
+    def _grid_keys(self, box: BorderBox) -> List[Tuple[int, int]]:
+        # Boxes with bottom right corner before top left one never overlap anything and get no grid cells
+        return [(col, row)
+                for col in range(int(box.top_left_x // self.cell_size), int(box.bottom_right_x // self.cell_size) + 1)
+                for row in range(int(box.top_left_y // self.cell_size), int(box.bottom_right_y // self.cell_size) + 1)]
+
+    def query(self, box: BorderBox) -> List[int]:
+        """
+        Indices of items overlapping box in insertion order
+        """
+        found = set()
+        for grid_key in self._grid_keys(box):
+            found.update(self._grid.get(grid_key, ()))
+        return sorted(idx for idx in found
+                      if self._alive[idx]
+                      and self.boxes[idx].top_left_x <= box.bottom_right_x
+                      and box.top_left_x <= self.boxes[idx].bottom_right_x
+                      and self.boxes[idx].top_left_y <= box.bottom_right_y
+                      and box.top_left_y <= self.boxes[idx].bottom_right_y)
+
+    def inside_another(self, box: BorderBox, threshold: float = 0.9) -> List[int]:
+        """
+        Indices of items for which box.box_is_inside_another(item box, threshold) holds, in insertion order
+        """
+        candidates = self.query(box)
+        count(CONTAINMENT_COUNTER, len(candidates))
+        return [idx for idx in candidates if box.box_is_inside_another(self.boxes[idx], threshold)]
+
+    def first_inside_another(self, box: BorderBox, threshold: float = 0.9) -> Optional[T]:
+        checked = 0
+        for idx in self.query(box):
+            checked += 1
+            if box.box_is_inside_another(self.boxes[idx], threshold):
+                count(CONTAINMENT_COUNTER, checked)
+                return self.items[idx]
+        count(CONTAINMENT_COUNTER, checked)
+        return None
+
+    def is_alive(self, idx: int) -> bool:
+        return self._alive[idx]
+
+    def remove(self, idx: int):
+        """
+        Exclude item from results of following queries
+        """
+        self._alive[idx] = False
+
+
+def suppress_overlapping(items: Sequence[T], key: Callable[[T], BorderBox] = lambda item: item,
+                         threshold: float = 0.9, confidence: Callable[[T], float] = lambda item: item.confidence) \
+        -> Tuple[List[T], List[T]]:
+    """
+    Greedy suppression of overlapping detections: items are taken from the end of the list,
+    the most confident one of a taken item and remaining items overlapping it is kept,
+    the overlapping remaining items are removed
+    @return: kept items in order they were kept and removed items in order they were removed
+    """
+    boxes = BoxArray.from_boxes([key(item) for item in items])
+    overlaps = boxes.inside_another(boxes, threshold)
+    alive = np.ones(len(items), dtype=bool)
+    kept: List[T] = []
+    removed: List[T] = []
+    for idx in range(len(items) - 1, -1, -1):
+        if not alive[idx]:
+            continue
+        alive[idx] = False
+        # Items after idx are already taken or removed
+        overlapping = np.flatnonzero(overlaps[idx, :idx] & alive[:idx])
+        candidates = [items[idx]] + [items[other] for other in overlapping]
+        kept.append(max(candidates, key=confidence))
+        alive[overlapping] = False
+        removed.extend(items[other] for other in overlapping)
+    return kept, removed
+
+
+class _SortedSpans:
+    """
+    Spans start..end, both included, sorted by starts and by ends like rows and columns of a grid
+    """
+    def __init__(self, starts: List[int], ends: List[int]):
+        self.starts = starts
+        self.ends = ends
+        self.is_sorted = all(a <= b for a, b in zip(starts, starts[1:])) and all(a <= b for a, b in zip(ends, ends[1:]))
+
+    def overlapping(self, start: int, end: int) -> range:
+        """
+        Indices of spans which may overlap start..end, all spans if they are not sorted
+        """
+        if not self.is_sorted:
+            return range(len(self.starts))
+        return range(bisect_left(self.ends, start), bisect_right(self.starts, end))
+
+
+class GridIndex:
+    """
+    Rows and columns of a grid table a box is matched to. Candidate rows and columns overlapping the box
+    are found by binary search over their borders, so matching is not a scan of all rows and columns,
+    the exact BorderBox.box_is_inside_another check is applied to candidates only.
+    """
+    def __init__(self, grid_table: ImplicitGridTable):
+        self.rows = grid_table.rows
+        self.cols = grid_table.cols
+        self._row_spans = _SortedSpans([row.top_left_y for row in self.rows], [row.bottom_right_y for row in self.rows])
+        self._col_spans = _SortedSpans([col.top_left_x for col in self.cols], [col.bottom_right_x for col in self.cols])
+
+    def rows_inside(self, box: BorderBox, threshold: float = 0.9) -> List[int]:
+        """
+        Indices of rows for which row.box_is_inside_another(box, threshold) holds, in order
+        """
+        candidates = self._row_spans.overlapping(box.top_left_y, box.bottom_right_y)
+        count(CONTAINMENT_COUNTER, len(candidates))
+        return [idx for idx in candidates if self.rows[idx].box_is_inside_another(box, threshold)]
+
+    def cols_inside(self, box: BorderBox, threshold: float = 0.9) -> List[int]:
+        """
+        Indices of columns for which col.box_is_inside_another(box, threshold) holds, in order
+        """
+        candidates = self._col_spans.overlapping(box.top_left_x, box.bottom_right_x)
+        count(CONTAINMENT_COUNTER, len(candidates))
+        return [idx for idx in candidates if self.cols[idx].box_is_inside_another(box, threshold)]
+
+    def first_row_inside(self, box: BorderBox, threshold: float = 0.9) -> Optional[int]:
+        checked = 0
+        for idx in self._row_spans.overlapping(box.top_left_y, box.bottom_right_y):
+            checked += 1
+            if self.rows[idx].box_is_inside_another(box, threshold):
+                count(CONTAINMENT_COUNTER, checked)
+                return idx
+        count(CONTAINMENT_COUNTER, checked)
+        return None
+
+    def first_col_inside(self, box: BorderBox, threshold: float = 0.9) -> Optional[int]:
+        checked = 0
+        for idx in self._col_spans.overlapping(box.top_left_x, box.bottom_right_x):
+            checked += 1
+            if self.cols[idx].box_is_inside_another(box, threshold):
+                count(CONTAINMENT_COUNTER, checked)
+                return idx
+        count(CONTAINMENT_COUNTER, checked)
+        return None
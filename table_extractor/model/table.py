@@ -1,10 +1,88 @@
+import itertools
+import os
 from functools import reduce
-from typing import List, Tuple, ClassVar
+from typing import List, Tuple, ClassVar, Dict, Optional
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 
+import numpy as np
 
-@dataclass
+
+class _BoxIds:
+    """
+    Box ids unique across worker processes: per process prefix and a counter, ids of boxes sent to another
+    process are kept with them. Prefix is the process id, pool workers get index of the worker instead.
+    Ids stay below 2 ** 53, so they are exact in JSON consumers using doubles.
+    """
+    COUNTER_BITS = 30
+    # Linux pid_max is at most 2 ** 22, worker indexes take prefixes above process ids
+    PID_LIMIT = 1 << 22
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._set_prefix(os.getpid() % self.PID_LIMIT)
+
+    def set_worker(self, index: int):
+        if not 0 <= index < self.PID_LIMIT:
+            raise ValueError(f"Worker index {index} is out of [0, {self.PID_LIMIT})")
+        self._set_prefix(self.PID_LIMIT | index)
+
+    def _set_prefix(self, prefix: int):
+        self._prefix = prefix << self.COUNTER_BITS
+        self._counter = itertools.count()
+
+    def next_id(self) -> int:
+        value = next(self._counter)
+        if value >> self.COUNTER_BITS:
+            raise RuntimeError(f"Box ids of prefix {self._prefix >> self.COUNTER_BITS} are exhausted")
+        return self._prefix | value
+
+
+_BOX_IDS = _BoxIds()
+# Forked workers would continue parent sequence with the same prefix
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_BOX_IDS.reset)
+
+
+def set_box_ids_worker(index: int):
+    """
+    Prefix box ids of the current process with index of its pool worker, unique among workers of the pool
+    """
+    _BOX_IDS.set_worker(index)
+
+
+def compact(cls):
+    """
+    Dataclass with __slots__, identity equality and hashing and pickled as a tuple of field values.
+    dataclass(slots=True) needs python 3.10, so the class is rebuilt with slots of its own fields here.
+    Equality by identity keeps list.remove and membership checks from comparing nested cells and text fields.
+    """
+    cls = dataclass(eq=False)(cls)
+    inherited = {name for base in cls.__mro__[1:] for name in getattr(base, '__slots__', ())}
+    names = tuple(f.name for f in fields(cls))
+    cls_dict = dict(cls.__dict__)
+    cls_dict['__slots__'] = tuple(name for name in names if name not in inherited)
+    # Defaults are kept by dataclass __init__, class attributes with slot names are not allowed
+    for name in names:
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in names)
+
+    def __setstate__(self, state):
+        for name, value in zip(names, state):
+            object.__setattr__(self, name, value)
+
+    cls_dict['__getstate__'] = __getstate__
+    cls_dict['__setstate__'] = __setstate__
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+@compact
 class BorderBox:
     top_left_x: int
     top_left_y: int
@@ -13,7 +91,7 @@ class BorderBox:
     bbox_id: int = field(init=False)
 
     def __post_init__(self):
-        self.bbox_id = id(self)
+        self.bbox_id = _BOX_IDS.next_id()
 
     @property
     def box(self):
@@ -67,13 +145,13 @@ class BorderBox:
         return self.box[item]
 
 
-@dataclass(unsafe_hash=True)
+@compact
 class TextField:
     bbox: BorderBox
     text: str
 
 
-@dataclass
+@compact
 class Cell(BorderBox):
     text_boxes: List[TextField] = field(default_factory=list)
     confidence: float = field(default=0.0)
@@ -94,65 +172,251 @@ class Cell(BorderBox):
     def is_empty(self):
         return not any(text_field.text for text_field in self.text_boxes)
 
-@dataclass
+@compact
 class GridCell(BorderBox):
     row: int = None
     col: int = None
     cells: List[Cell] = field(default_factory=list)
 
 
-@dataclass
+@compact
 class GridRow(BorderBox):
-    g_cells: List[GridCell] = field(default_factory=list)
+    pass
 
 
-@dataclass
+@compact
 class GridCol(BorderBox):
-    g_cells: List[GridCell] = field(default_factory=list)
-
-
-@dataclass
-class GridTable:
-    rows: List[GridRow] = field(default_factory=list)
-    cols: List[GridCol] = field(default_factory=list)
-    cells: List[GridCell] = field(default_factory=list)
-
-
-@dataclass
+    pass
+
+
+class ImplicitGridTable:
+    """
+    Grid between sorted horizontal and vertical lines which keeps only the lines, rows and columns
+    and slots cells were assigned to. GridCell of a slot is created on first access,
+    so memory and build time grow with rows + columns and occupied slots instead of rows x columns.
+    Slots are numbered row by row.
+    """
+    def __init__(self, h_lines: List[int], v_lines: List[int]):
+        self.h_lines = np.asarray(h_lines)
+        self.v_lines = np.asarray(v_lines)
+        h_lines = self.h_lines.tolist()
+        v_lines = self.v_lines.tolist()
+        self.rows: List[GridRow] = [
+            GridRow(top_left_x=v_lines[0], top_left_y=top, bottom_right_x=v_lines[-1], bottom_right_y=bottom)
+            for top, bottom in zip(h_lines, h_lines[1:])
+        ]
+        self.cols: List[GridCol] = [
+            GridCol(top_left_x=left, top_left_y=h_lines[0], bottom_right_x=right, bottom_right_y=h_lines[-1])
+            for left, right in zip(v_lines, v_lines[1:])
+        ]
+        self._g_cells: Dict[int, GridCell] = {}
+        self._assigned: List[int] = []
+
+    def slot(self, row: int, col: int) -> int:
+        return row * len(self.cols) + col
+
+    def cell(self, row: int, col: int) -> GridCell:
+        slot = self.slot(row, col)
+        g_cell = self._g_cells.get(slot)
+        if g_cell is None:
+            g_cell = GridCell(
+                top_left_x=self.cols[col].top_left_x,
+                bottom_right_x=self.cols[col].bottom_right_x,
+                top_left_y=self.rows[row].top_left_y,
+                bottom_right_y=self.rows[row].bottom_right_y,
+                row=row,
+                col=col
+            )
+            self._g_cells[slot] = g_cell
+        return g_cell
+
+    def assign(self, row: int, col: int, cell: Cell) -> GridCell:
+        g_cell = self.cell(row, col)
+        g_cell.cells.append(cell)
+        self._assigned.append(self.slot(row, col))
+        return g_cell
+
+    def occupied(self) -> List[GridCell]:
+        """
+        Grid cells with assigned cells in slot order
+        """
+        slots = np.unique(np.array(self._assigned, dtype=np.int64))
+        return [self._g_cells[slot] for slot in slots.tolist()]
+
+    def row_cells(self, row: int) -> List[GridCell]:
+        return [self.cell(row, col) for col in range(len(self.cols))]
+
+    def col_cells(self, col: int) -> List[GridCell]:
+        return [self.cell(row, col) for row in range(len(self.rows))]
+
+
+class _LayoutVersion:
+    """
+    Bumped on every change of grid placement of any linked cell, indexes built before it are rebuilt
+    """
+    value = 0
+
+
+_LAYOUT_FIELDS = frozenset(('col', 'row', 'col_span', 'row_span'))
+
+
+@compact
 class CellLinked(Cell):
     col: int = 0
     row: int = 0
     col_span: int = 0
     row_span: int = 0
 
-
-@dataclass
+    def __setattr__(self, name, value):
+        if name in _LAYOUT_FIELDS:
+            _LayoutVersion.value += 1
+        object.__setattr__(self, name, value)
+
+
+class CellList(list):
+    """
+    List of table cells counting its writes, so grouping of cells built from it is rebuilt after them
+    """
+    version = 0
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        self._changed()
+        super(CellList, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._changed()
+        super(CellList, self).__delitem__(key)
+
+    def __iadd__(self, other):
+        self._changed()
+        return super(CellList, self).__iadd__(other)
+
+    def __imul__(self, other):
+        self._changed()
+        return super(CellList, self).__imul__(other)
+
+    def append(self, cell):
+        self._changed()
+        super(CellList, self).append(cell)
+
+    def extend(self, cells):
+        self._changed()
+        super(CellList, self).extend(cells)
+
+    def insert(self, idx, cell):
+        self._changed()
+        super(CellList, self).insert(idx, cell)
+
+    def remove(self, cell):
+        self._changed()
+        super(CellList, self).remove(cell)
+
+    def pop(self, *args):
+        self._changed()
+        return super(CellList, self).pop(*args)
+
+    def clear(self):
+        self._changed()
+        super(CellList, self).clear()
+
+    def sort(self, *args, **kwargs):
+        self._changed()
+        super(CellList, self).sort(*args, **kwargs)
+
+    def reverse(self):
+        self._changed()
+        super(CellList, self).reverse()
+
+
+class CellIndex:
+    """
+    Cells of a table grouped by row and column numbers and placed on grid slots they span
+    """
+    def __init__(self, cells: List[CellLinked]):
+        rows: Dict[int, List[CellLinked]] = {}
+        cols: Dict[int, List[CellLinked]] = {}
+        self.slots: Dict[Tuple[int, int], CellLinked] = {}
+        self.spanning_rows: Dict[int, List[CellLinked]] = {}
+        self.spanning_cols: Dict[int, List[CellLinked]] = {}
+        for cell in cells:
+            rows.setdefault(cell.row, []).append(cell)
+            cols.setdefault(cell.col, []).append(cell)
+            # Spans of cells built without them are 0
+            row_nums = range(cell.row, cell.row + max(1, cell.row_span))
+            col_nums = range(cell.col, cell.col + max(1, cell.col_span))
+            for row in row_nums:
+                self.spanning_rows.setdefault(row, []).append(cell)
+            for col in col_nums:
+                self.spanning_cols.setdefault(col, []).append(cell)
+            for row in row_nums:
+                for col in col_nums:
+                    self.slots.setdefault((row, col), cell)
+        self.row_nums = sorted(rows)
+        self.col_nums = sorted(cols)
+        self.rows = [rows[num] for num in self.row_nums]
+        self.cols = [cols[num] for num in self.col_nums]
+        self.rows_by_num = rows
+        self.cols_by_num = cols
+
+
+@dataclass(eq=False)
 class StructuredTable:
+    """
+    Row and column grouping of cells is kept until cells list is written or any linked cell is moved,
+    assigned cells are copied to a CellList tracking its writes
+    """
     bbox: BorderBox
     cells: List[CellLinked] = field(default_factory=list)
 
-    @property
-    def rows(self):
-        rows = {}
-        for cell in self.cells:
-            if cell.row not in rows:
-                rows[cell.row] = [cell]
-            else:
-                rows[cell.row].append(cell)
-        return [row for num, row in sorted([(num, row) for num, row in rows.items()], key=lambda x: x[0])]
+    def __setattr__(self, name, value):
+        if name == 'cells':
+            if not isinstance(value, CellList):
+                value = CellList(value)
+            self.__dict__['_cell_index'] = None
+        super(StructuredTable, self).__setattr__(name, value)
 
     @property
-    def cols(self):
-        cols = {}
-        for cell in self.cells:
-            if cell.col not in cols:
-                cols[cell.col] = [cell]
-            else:
-                cols[cell.col].append(cell)
-        return [col for num, col in sorted([(num, col) for num, col in cols.items()], key=lambda x: x[0])]
+    def cell_index(self) -> CellIndex:
+        index, state = self.__dict__.get('_cell_index') or (None, None)
+        current = (self.cells.version, _LayoutVersion.value)
+        if index is None or state != current:
+            index = CellIndex(self.cells)
+            self.__dict__['_cell_index'] = (index, current)
+        return index
 
+    @property
+    def rows(self) -> List[List[CellLinked]]:
+        return [list(row) for row in self.cell_index.rows]
 
-@dataclass
+    @property
+    def cols(self) -> List[List[CellLinked]]:
+        return [list(col) for col in self.cell_index.cols]
+
+    def cell_at(self, row: int, col: int) -> Optional[CellLinked]:
+        """
+        Cell placed on or spanning over grid slot
+        """
+        return self.cell_index.slots.get((row, col))
+
+    def row_cells(self, row: int, with_spans: bool = False) -> List[CellLinked]:
+        """
+        @param with_spans: also return cells starting in rows above and spanning over the row
+        """
+        index = self.cell_index
+        return list((index.spanning_rows if with_spans else index.rows_by_num).get(row, []))
+
+    def col_cells(self, col: int, with_spans: bool = False) -> List[CellLinked]:
+        """
+        @param with_spans: also return cells starting in columns to the left and spanning over the column
+        """
+        index = self.cell_index
+        return list((index.spanning_cols if with_spans else index.cols_by_num).get(col, []))
+
+
+@dataclass(eq=False)
 class StructuredTableHeadered(StructuredTable):
     header: List[List[CellLinked]] = field(default_factory=list)
 
@@ -1,12 +1,11 @@
+import threading
 from pathlib import Path
 from typing import List
 
 import numpy
 
-from paddleocr.tools.infer.predict_det import TextDetector, logger
-
 from table_extractor.model.table import BorderBox, TextField
-from utility import create_predictor
+from table_extractor.profiling.stage_profiler import profiled
 from dataclasses import dataclass
 
 
@@ -56,6 +55,10 @@ def get_text_detector(
         det_model_dir='./paddle_detector/inference/ch_ppocr_mobile_v2.0_det_infer',
         cls_model_dir='./paddle_detector/inference/ch_ppocr_mobile_v2.0_cls_infer',
 ):
+    # Paddle is loaded only when detector is created, not on module import
+    from paddleocr.tools.infer.predict_det import TextDetector, logger
+    from utility import create_predictor
+
     args = TextDetectorConfig()
     args.det_model_dir = det_model_dir
     args.cls_model_dir = cls_model_dir
@@ -91,10 +94,13 @@ class PaddleDetector:
             str(det_model_dir.absolute()),
             str(cls_model_dir.absolute())
         )
+        # Paddle predictor is not thread safe
+        self._lock = threading.Lock()
 
     def extract_table_text(self, img: numpy.ndarray, border_box: BorderBox) -> List[TextField]:
         x1, y1, x2, y2 = border_box.box
-        dt_boxes, elapse = self.text_detector(img[y1:y2, x1:x2])
+        with self._lock:
+            dt_boxes, elapse = self.text_detector(img[y1:y2, x1:x2])
         bboxes = paddle_result_to_bboxes(dt_boxes)
         return [TextField(bbox=cell, text='') for cell in
                 (BorderBox(b[0]+x1, b[1]+y1, b[2]+x1, b[3]+y1) for b in bboxes)]
@@ -106,6 +112,7 @@ class PaddleSwitchWrapper(PaddleDetector):
         if paddle_on:
             super(PaddleSwitchWrapper, self).__init__(det_model_dir, cls_model_dir)
 
+    @profiled('paddle')
     def extract_table_text(self, img: numpy.ndarray, border_box: BorderBox) -> List[TextField]:
         if not self.paddle_on:
             return []
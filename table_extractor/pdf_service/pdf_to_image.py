@@ -1,16 +1,37 @@
 import logging
 import shutil
 from pathlib import Path
+
+import numpy as np
 from pdf2image import convert_from_path
+from poppler import PageRenderer, RenderHint
 
 logger = logging.getLogger(__name__)
 DPI = 400
 
 
-# ToDo: Implement also with pagination
+def get_images_dir(pdf_file: Path, out_dir: Path) -> Path:
+    return out_dir.joinpath(Path(f"{pdf_file.name}/images/"))
+
+
+def render_pdf_page(pdf_document, page_num: int, dpi: int = DPI) -> np.ndarray:
+    """
+    Render pdf page straight to BGR image buffer without encoding it to png
+    @param pdf_document: poppler document
+    @param page_num: zero based page number
+    """
+    renderer = PageRenderer()
+    renderer.set_render_hint(RenderHint.antialiasing, True)
+    renderer.set_render_hint(RenderHint.text_antialiasing, True)
+    image = renderer.render_page(pdf_document.create_page(page_num), xres=dpi, yres=dpi)
+    buffer = np.frombuffer(image.data, dtype=np.uint8).reshape((image.height, image.bytes_per_row // 4, 4))
+    # argb32 is stored as BGRA on little-endian platforms
+    return np.ascontiguousarray(buffer[:, :image.width, :3])
+
+
 def convert_pdf_to_images(pdf_file: Path, out_dir: Path) -> Path:
     logger.info("Start pdf to png conversion for %s", str(pdf_file.name))
-    out_dir = out_dir.joinpath(Path(f"{pdf_file.name}/images/"))
+    out_dir = get_images_dir(pdf_file, out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     pages = convert_from_path(
         pdf_file,
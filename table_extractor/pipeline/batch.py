@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Set, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'batch_manifest.jsonl'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+# Output directory of documents outside of the batch source directory
+EXTERNAL_DIR = '_external'
+
+
+def list_batch_documents(source: Path) -> List[Path]:
+    """
+    Collect pdf documents of a batch
+    @param source: directory searched recursively for pdf files or
+    jsonl manifest with {"pdf_path": ...} per line, relative paths are resolved against manifest directory
+    """
+    if source.is_dir():
+        return sorted(path for path in source.rglob("*") if path.suffix.lower() == '.pdf')
+    documents = []
+    with open(str(source.absolute()), 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            pdf_path = Path(json.loads(line)['pdf_path'])
+            documents.append(pdf_path if pdf_path.is_absolute() else source.parent / pdf_path)
+    return documents
+
+
+def document_output_root(source: Path, pdf_path: Path, output_path: Path) -> Path:
+    """
+    Directory results of pdf_path are written to as <root>/<pdf name>/, documents with the same name
+    from different directories get different roots.
+    Documents under the source directory, or under the manifest directory, keep their relative directory,
+    other ones are placed by hash of their directory path
+    """
+    base = Path(os.path.abspath(str(source if source.is_dir() else source.parent)))
+    directory = Path(os.path.abspath(str(pdf_path))).parent
+    try:
+        return output_path / directory.relative_to(base)
+    except ValueError:
+        return output_path / EXTERNAL_DIR / hashlib.sha1(str(directory).encode('utf-8')).hexdigest()[:16]
+
+
+class BatchManifest:
+    """
+    Append only record of processed documents, lets interrupted batch resume from the first not done document.
+    Failed documents are retried on the next run.
+    """
+    def __init__(self, output_path: Path):
+        self.path = output_path / MANIFEST_NAME
+        self.done: Set[str] = set()
+        if self.path.exists():
+            with open(str(self.path.absolute()), 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line can be partially written if batch was killed
+                        logger.warning("Skipping broken manifest line: %s", line)
+                        continue
+                    if record['status'] == STATUS_DONE:
+                        self.done.add(record['pdf_path'])
+                    else:
+                        self.done.discard(record['pdf_path'])
+
+    @staticmethod
+    def _key(pdf_path: Path) -> str:
+        return str(pdf_path.absolute())
+
+    def is_done(self, pdf_path: Path) -> bool:
+        return self._key(pdf_path) in self.done
+
+    def record(self, pdf_path: Path, status: str, document_path: Optional[Path] = None, error: Optional[str] = None,
+               output_dir: Optional[Path] = None):
+        """
+        @param output_dir: directory with images, document and profile of pdf_path
+        """
+        record = {
+            'pdf_path': self._key(pdf_path),
+            'status': status,
+            'output_dir': str(output_dir.absolute()) if output_dir else None,
+            'document_path': str(document_path.absolute()) if document_path else None,
+            'error': error
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(self.path.absolute()), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if status == STATUS_DONE:
+            self.done.add(record['pdf_path'])
+        else:
+            self.done.discard(record['pdf_path'])
@@ -1,6 +1,6 @@
 import json
 import logging
-from typing import List, Tuple, Dict, Any, Union
+from typing import List, Tuple, Dict, Any, Union, Optional
 
 from pathlib import Path
 
@@ -10,19 +10,28 @@ from tesserocr import PSM
 
 from table_extractor.bordered_service.bordered_tables_detection import detect_tables_on_page
 from table_extractor.bordered_service.models import InferenceTable, Page
+from table_extractor.cache_service.result_cache import PageResultCache, hash_pdf
 from table_extractor.cascade_rcnn_service.inference import CascadeRCNNInferenceService
 from table_extractor.headers.header_utils import HeaderChecker
 from table_extractor.inference_table_service.constuct_table_from_inference import construct_table_from_cells, \
-    find_grid_table, reconstruct_table_from_grid
+    reconstruct_table_from_grid
+from table_extractor.model.box_array import BoxArray
+from table_extractor.model.spatial_index import BoxIndex
 from table_extractor.model.table import StructuredTable, TextField, Cell, Table, BorderBox, CellLinked, \
-    StructuredTableHeadered
+    StructuredTableHeadered, ImplicitGridTable
 from table_extractor.paddle_service.text_detector import PaddleDetector
-from table_extractor.pdf_service.pdf_to_image import convert_pdf_to_images
-from table_extractor.poppler_service.poppler_text_extractor import extract_text, \
-    poppler_text_field_to_text_field, PopplerPage
+from table_extractor.pdf_service.pdf_to_image import render_pdf_page, get_images_dir, DPI
+from table_extractor.poppler_service.poppler_text_extractor import poppler_text_field_to_text_field, open_document, \
+    extract_page_text
 from table_extractor.borderless_service.semi_bordered import semi_bordered
-from table_extractor.tesseract_service.tesseract_extractor import TextExtractor
-from table_extractor.text_cells_matcher.text_cells_matcher import match_table_text, match_cells_text_fields
+from table_extractor.tesseract_service.numeric_ocr import recognize_cells
+from table_extractor.tesseract_service.ocr_cache import OcrCache
+from table_extractor.tesseract_service.ocr_planner import OcrPlanner, text_fields_to_text
+from table_extractor.tesseract_service.tesseract_extractor import TesseractPool, PageTextExtractor, words_to_text, \
+    OCR_MODE_CELLS, OCR_MODE_WORDS, OCR_MODES
+from table_extractor.text_cells_matcher.text_cells_matcher import match_table_text, match_cells_text_fields, \
+    assign_words_to_cells, box_contains_center
+from table_extractor.profiling.stage_profiler import StageProfiler, profile, stage, profiled, PROFILE_DIR
 from table_extractor.visualization.table_visualizer import TableVisualizer
 
 logger = logging.getLogger(__name__)
@@ -64,23 +73,22 @@ def actualize_header(table: StructuredTable):
 def merge_text_fields(paddle_t_b: List[TextField], poppler_t_b: List[TextField]) -> List[TextField]:
     not_matched = []
     merged_t_b = []
-    for pop_t_b in poppler_t_b:
+    paddle_boxes = BoxArray.from_boxes([t_b.bbox for t_b in paddle_t_b])
+    pop_in_pad = BoxArray.from_boxes([t_b.bbox for t_b in poppler_t_b]).inside_another(paddle_boxes, threshold=0.00)
+    for pop_t_b, pad_matches in zip(poppler_t_b, pop_in_pad):
         merged = False
-        for pad_t_b in paddle_t_b:
-            if pop_t_b.bbox.box_is_inside_another(pad_t_b.bbox, threshold=0.00):
-                merged_t_b.append(TextField(
-                    bbox=pad_t_b.bbox.merge(pop_t_b.bbox),
-                    text=pop_t_b.text
-                ))
-                merged = True
+        for idx in np.flatnonzero(pad_matches):
+            pad_t_b = paddle_t_b[idx]
+            merged_t_b.append(TextField(
+                bbox=pad_t_b.bbox.merge(pop_t_b.bbox),
+                text=pop_t_b.text
+            ))
+            merged = True
         if not merged:
             not_matched.append(pop_t_b)
 
-    for pad_t_b in paddle_t_b:
-        exists = False
-        for mer_t_b in merged_t_b:
-            if mer_t_b.bbox.box_is_inside_another(pad_t_b.bbox, threshold=0.0):
-                exists = True
+    pad_exists = BoxArray.from_boxes([t_b.bbox for t_b in merged_t_b]).inside_another(paddle_boxes, threshold=0.0)
+    for pad_t_b, exists in zip(paddle_t_b, pad_exists.any(axis=0)):
         if not exists:
             not_matched.append(pad_t_b)
 
@@ -120,21 +128,46 @@ def merge_closest_text_fields(text_fields: List[TextField]):
     return merged_fields
 
 
-def pdf_preprocess(pdf_path: Path, output_path: Path) -> Tuple[Path, Dict[str, PopplerPage]]:
-    images_path = convert_pdf_to_images(pdf_path, output_path)
-    poppler_pages = extract_text(pdf_path)
-    return images_path, poppler_pages
-
-
-def actualize_text(table: StructuredTable, image_path: Path):
-    with TextExtractor(str(image_path.absolute())) as te:
-        for cell in table.cells:
-            if not cell.text_boxes or any([not text_box.text for text_box in cell.text_boxes]):
-                text, _ = te.extract(
-                    cell.top_left_x, cell.top_left_y,
-                    cell.width, cell.height
-                )
-                cell.text_boxes.append(TextField(bbox=cell, text=text))
+@profiled('tesseract_cells')
+def actualize_text(table: StructuredTable, page_ocr: PageTextExtractor, ocr_mode: str = OCR_MODE_CELLS,
+                   planner: Optional[OcrPlanner] = None, numeric_ocr: bool = False):
+    cells = [cell for cell in table.cells
+             if (not cell.text_boxes or any([not text_box.text for text_box in cell.text_boxes]))
+             and (planner is None or planner.needs_ocr(cell, cell.text_boxes))]
+    if ocr_mode == OCR_MODE_WORDS:
+        cells_words = assign_words_to_cells(cells, page_ocr.words_in(table.bbox))
+        texts = [words_to_text(words) for words in cells_words]
+    elif numeric_ocr:
+        texts = recognize_cells(table, cells, page_ocr)
+    else:
+        texts = [text for text, _ in page_ocr.extract_many([
+            (cell.top_left_x, cell.top_left_y, cell.width, cell.height) for cell in cells
+        ])]
+    for cell, text in zip(cells, texts):
+        cell.text_boxes.append(TextField(bbox=cell, text=text))
+
+
+def _tesseract_regions(page_ocr: PageTextExtractor, text_fields: List[Cell], ocr_mode: str) \
+        -> List[List[Tuple[int, int, int, int]]]:
+    """
+    Page coordinates of text found by tesseract inside every text field
+    """
+    if ocr_mode == OCR_MODE_WORDS:
+        bbox = text_fields[0]
+        for text_field in text_fields[1:]:
+            bbox = bbox.merge(text_field)
+        return [[word.bbox.box for word in words]
+                for words in assign_words_to_cells(text_fields, page_ocr.words_in(bbox))]
+    ocr_results = page_ocr.extract_regions_many([
+        (text_field.top_left_x, text_field.top_left_y, text_field.width, text_field.height)
+        for text_field in text_fields
+    ])
+    # Tesseract regions are relative to requested rectangle
+    return [[(text_field.top_left_x + reg[1]['x'],
+              text_field.top_left_y + reg[1]['y'],
+              text_field.top_left_x + reg[1]['x'] + reg[1]['w'],
+              text_field.top_left_y + reg[1]['y'] + reg[1]['h']) for reg in region or []]
+            for text_field, (text, conf, region) in zip(text_fields, ocr_results)]
 
 
 def semi_border_to_struct(semi_border: Table, image_shape: Tuple[int, int]) -> StructuredTable:
@@ -166,7 +199,7 @@ def bordered_to_struct(bordered_table: Table) -> StructuredTable:
     cells = []
     for row in bordered_table.rows:
         cells.extend(row.objs)
-    grid = find_grid_table(h_lines, v_lines)
+    grid = ImplicitGridTable(h_lines, v_lines)
     table, _ = reconstruct_table_from_grid(grid, cells)
     return table
 
@@ -256,22 +289,51 @@ class PageProcessor:
                  inference_service: CascadeRCNNInferenceService,
                  text_detector: PaddleDetector,
                  visualizer: TableVisualizer,
-                 paddle_on=True
+                 paddle_on=True,
+                 result_cache: Optional[PageResultCache] = None,
+                 profile: bool = False,
+                 ocr_threads: Optional[int] = None,
+                 ocr_mode: str = OCR_MODE_CELLS,
+                 plan_ocr: bool = False,
+                 ocr_cache: Optional[OcrCache] = None,
+                 numeric_ocr: bool = False,
+                 ocr_resolution: Optional[int] = None,
+                 ocr_learning: bool = True
                  ):
+        """
+        @param ocr_mode: OCR_MODE_CELLS recognizes every cell separately,
+        OCR_MODE_WORDS recognizes page once and assigns words to cells by their boxes
+        @param plan_ocr: skip tesseract for blank rectangles and rectangles covered by pdf text layer
+        @param ocr_cache: tesseract results of already seen crops
+        @param numeric_ocr: recognize cells of numeric columns as a single line of digits in OCR_MODE_CELLS
+        @param ocr_resolution: resolution pages are downscaled to for tesseract, pages are recognized with DPI
+        if not set
+        @param ocr_learning: tesseract adaptive learning, without it cells of a page are recognized in parallel
+        with different results
+        """
+        if ocr_mode not in OCR_MODES:
+            raise ValueError(f"Unknown OCR mode {ocr_mode}, expected one of {OCR_MODES}")
         self.inference_service = inference_service
         self.text_detector = text_detector
         self.visualizer = visualizer
         self.paddle_on = paddle_on
         self.header_checker = HeaderChecker()
-
-    def cell_in_inf_header(self, cell: CellLinked, inf_headers: List[Cell]) -> float:
+        # Tesseract engines are initialised once per thread and reused for all pages
+        self.ocr_pool = TesseractPool(ocr_threads, ocr_cache, ocr_learning)
+        self.ocr_mode = ocr_mode
+        self.plan_ocr = plan_ocr
+        self.numeric_ocr = numeric_ocr
+        self.ocr_resolution = ocr_resolution
+        self.result_cache = result_cache
+        self.profile = profile
+
+    def cell_in_inf_header(self, cell: CellLinked, inf_headers: BoxIndex[Cell]) -> float:
         confidences = [0.]
-        for header in inf_headers:
-            if cell.box_is_inside_another(header):
-                confidences.append(header.confidence)
+        for idx in inf_headers.inside_another(cell):
+            confidences.append(inf_headers.items[idx].confidence)
         return max(confidences)
 
-    def analyse(self, series: List[CellLinked], inf_headers: List[Cell]):
+    def analyse(self, series: List[CellLinked], inf_headers: BoxIndex[Cell]):
         # Check if series is header
         headers = []
         first_line = False
@@ -291,7 +353,7 @@ class PageProcessor:
         # return len(headers) > (len(series) / 5) if len(series) > thresh else len(headers) > (len(series) / 2)
         return len(headers) > (len(series) / 2)
 
-    def create_header(self, series: List[List[CellLinked]], inf_headers: List[Cell], header_limit: int):
+    def create_header(self, series: List[List[CellLinked]], inf_headers: BoxIndex[Cell], header_limit: int):
         """
         Search for headers based on cells contents
         @param series: cols or rows of the table
@@ -328,7 +390,9 @@ class PageProcessor:
                                      inf_table: InferenceTable,
                                      not_matched_text: List[TextField],
                                      image_shape: Tuple[int, int],
-                                     image_path: Path) -> StructuredTable:
+                                     image_path: Path,
+                                     page_ocr: PageTextExtractor,
+                                     planner: Optional[OcrPlanner] = None) -> StructuredTable:
         merged_t_fields = merge_closest_text_fields(sorted(not_matched_text,
                                                            key=lambda x: (x.bbox.top_left_y, x.bbox.top_left_x)))
 
@@ -346,25 +410,16 @@ class PageProcessor:
 
         inf_table.tags.extend([text_to_cell(text_field) for text_field in merged_t_fields])
 
-        with TextExtractor(str(image_path.absolute())) as te:
-            for text_field in inf_table.tags:
-                text, conf, region = te.extract_region(
-                    text_field.top_left_x, text_field.top_left_y,
-                    text_field.width, text_field.height
-                )
-                if region:
-                    regions = [[reg[1]['x'],
-                                reg[1]['y'],
-                                reg[1]['x'] + reg[1]['w'],
-                                reg[1]['y'] + reg[1]['h']] for reg in region]
-                    text_field.bottom_right_x = min(text_field.top_left_x + max([x2 for x, y, x2, y2 in regions]),
-                                                    text_field.bottom_right_x)
-                    text_field.bottom_right_y = min(text_field.top_left_y + max([y2 for x, y, x2, y2 in regions]),
-                                                    text_field.bottom_right_y)
-                    text_field.top_left_x = max(text_field.top_left_x + min([x for x, y, x2, y2 in regions]),
-                                                text_field.top_left_x)
-                    text_field.top_left_y = max(text_field.top_left_y + min([y for x, y, x2, y2 in regions]),
-                                                text_field.top_left_y)
+        with stage('tesseract_regions'):
+            # Tags with text layer boxes are already fitted to them above
+            tags = [tag for tag in inf_table.tags if planner is None or planner.needs_ocr(tag, tag.text_boxes)]
+            tags_regions = _tesseract_regions(page_ocr, tags, self.ocr_mode) if tags else []
+            for text_field, regions in zip(tags, tags_regions):
+                if regions:
+                    text_field.bottom_right_x = min(max([x2 for x, y, x2, y2 in regions]), text_field.bottom_right_x)
+                    text_field.bottom_right_y = min(max([y2 for x, y, x2, y2 in regions]), text_field.bottom_right_y)
+                    text_field.top_left_x = max(min([x for x, y, x2, y2 in regions]), text_field.top_left_x)
+                    text_field.top_left_y = max(min([y for x, y, x2, y2 in regions]), text_field.top_left_y)
         self.visualizer.draw_object_and_save(img, [inf_table],
                                              image_path.parent.parent / 'modified_cells'
                                              / f"{str(image_path.name).replace('.png', '')}_"
@@ -379,21 +434,81 @@ class PageProcessor:
                                                  Path(f"{output_path}/poppler_text/{image_path.name}"))
         return text_fields
 
-    def process_pages(self, images_path: Path, poppler_pages: Dict[str, PopplerPage]) -> List:
+    def process_pdf(self, pdf_path: Path, output_path: Path) -> List:
+        pdf_document = open_document(pdf_path)
+        images_path = get_images_dir(pdf_path, output_path)
+        document_hash = hash_pdf(pdf_path) if self.result_cache else None
         pages = []
-        for image_path in sorted(images_path.glob("*.png")):
-            try:
-                pages.append(self.process_page(image_path,
-                                               images_path.parent,
-                                               poppler_pages[image_path.name.split(".")[0]]))
-            except Exception as e:
-                # ToDo: Rewrite, needed to not to fail pipeline for now in sequential mode
-                logger.warning(str(e))
-                raise e
+        for page_num in range(pdf_document.pages):
+            pages.append(self.process_document_page(pdf_document, page_num, images_path, document_hash))
         return pages
 
-    def process_page(self, image_path: Path, output_path: Path, poppler_page) -> Dict[str, Any]:
-        img = cv2.imread(str(image_path.absolute()))
+    def get_cached_page(self, document_hash: Optional[str], page_num: int) -> Optional[Dict[str, Any]]:
+        if not self.result_cache or not document_hash:
+            return None
+        return self.result_cache.get(document_hash, page_num)
+
+    def cache_page(self, document_hash: Optional[str], page_num: int, page: Dict[str, Any]):
+        if self.result_cache and document_hash:
+            self.result_cache.put(document_hash, page_num, page)
+
+    def render_page(self, pdf_document, page_num: int, images_path: Path) -> Tuple[Path, np.ndarray]:
+        """
+        Render page in memory, page image is saved to images_path only if visualization is on
+        """
+        img = render_pdf_page(pdf_document, page_num)
+        image_path = images_path / f"{page_num}.png"
+        if self.visualizer.should_visualize:
+            images_path.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(str(image_path.absolute()), img)
+        return image_path, img
+
+    def process_document_page(self,
+                              pdf_document,
+                              page_num: int,
+                              images_path: Path,
+                              document_hash: Optional[str] = None) -> Dict[str, Any]:
+        """
+        @param document_hash: hash of pdf content, page result is looked up in result cache by it
+        """
+        page = self.get_cached_page(document_hash, page_num)
+        if page is not None:
+            return page
+        image_path, img = self.render_page(pdf_document, page_num, images_path)
+        page = self.process_page(image_path, images_path.parent, extract_page_text(pdf_document, page_num), img=img)
+        self.cache_page(document_hash, page_num, page)
+        return page
+
+    def process_page(self,
+                     image_path: Path,
+                     output_path: Path,
+                     poppler_page,
+                     inference_result: Optional[Tuple[List[InferenceTable], List[Cell]]] = None,
+                     img: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """
+        Process single page image
+        @param image_path: path of page image, image is read from it if img is not provided
+        @param inference_result: precomputed result of inference_service.inference_image for the page,
+        inference runs inside if not provided
+        @param img: page image buffer shared by all processing stages
+        """
+        if not self.profile:
+            return self._process_page(image_path, output_path, poppler_page, inference_result, img)
+        profiler = StageProfiler()
+        with profile(profiler), profiler.stage('page'):
+            page_dict = self._process_page(image_path, output_path, poppler_page, inference_result, img)
+        save_page(profiler.to_dict(), output_path / PROFILE_DIR / f"{page_dict['page_num']}.json")
+        return page_dict
+
+    def _process_page(self,
+                      image_path: Path,
+                      output_path: Path,
+                      poppler_page,
+                      inference_result: Optional[Tuple[List[InferenceTable], List[Cell]]],
+                      img: Optional[np.ndarray]) -> Dict[str, Any]:
+        if img is None:
+            img = cv2.imread(str(image_path.absolute()))
+        page_ocr = self.ocr_pool.page(img, source_resolution=DPI, ocr_resolution=self.ocr_resolution)
         page = Page(
             page_num=int(image_path.name.split(".")[0]),
             bbox=BorderBox(
@@ -403,9 +518,14 @@ class PageProcessor:
                 bottom_right_y=img.shape[0]
             )
         )
-        text_fields = self._scale_poppler_result(img, output_path, poppler_page, image_path)
-
-        inference_tables, headers = self.inference_service.inference_image(image_path)
+        with stage('poppler'):
+            text_fields = self._scale_poppler_result(img, output_path, poppler_page, image_path)
+        planner = OcrPlanner(img) if self.plan_ocr else None
+
+        if inference_result is None:
+            with stage('cascade'):
+                inference_result = self.inference_service.inference_image(image_path, image=img)
+        inference_tables, headers = inference_result
         if not inference_tables:
             return page_to_dict(page)
 
@@ -436,12 +556,13 @@ class PageProcessor:
                         if struct_table:
                             detected_tables.append((semi_border_score, struct_table))
                         continue
-            struct = self.extract_table_from_inference(img, inf_table, not_matched, img.shape, image_path)
+            struct = self.extract_table_from_inference(img, inf_table, not_matched, img.shape, image_path, page_ocr,
+                                                       planner)
             if struct:
                 detected_tables.append((mask_rcnn_count_matches, struct))
 
         if has_bordered or any(score < 0.2 * len(table.cells) for score, table in detected_tables):
-            image = detect_tables_on_page(image_path, draw=self.visualizer.should_visualize)
+            image = detect_tables_on_page(image_path, draw=self.visualizer.should_visualize, img=img)
             if image.tables:
                 text_fields_to_match = text_fields
                 for bordered_table in image.tables:
@@ -477,28 +598,31 @@ class PageProcessor:
         else:
             page.tables.extend([tab for _, tab in detected_tables])
         for table in page.tables:
-            actualize_text(table, image_path)
+            actualize_text(table, page_ocr, self.ocr_mode, planner, self.numeric_ocr)
 
         # TODO: Headers should be created only once
         cell_header_scores = []
-        for table in page.tables:
-            cell_header_scores.extend(self.header_checker.get_cell_scores(table.cells))
+        with stage('header_scoring'):
+            for table in page.tables:
+                cell_header_scores.extend(self.header_checker.get_cell_scores(table.cells))
 
         self.visualizer.draw_object_and_save(img,
                                              cell_header_scores,
                                              output_path / 'cells_header' / f"{page.page_num}.png")
 
         tables_with_header = []
-        for table in page.tables:
-            header_rows = self.create_header(table.rows, headers, 6)
-            table_with_header = StructuredTableHeadered.from_structured_and_rows(table, header_rows)
-            header_cols = self.create_header(table.cols, headers, 5)
-            # TODO: Cells should be actualized only once
-            table_with_header.actualize_header_with_cols(header_cols)
-            tables_with_header.append(table_with_header)
+        with stage('header_scoring'):
+            headers_index = BoxIndex(headers)
+            for table in page.tables:
+                header_rows = self.create_header(table.rows, headers_index, 6)
+                table_with_header = StructuredTableHeadered.from_structured_and_rows(table, header_rows)
+                header_cols = self.create_header(table.cols, headers_index, 5)
+                # TODO: Cells should be actualized only once
+                table_with_header.actualize_header_with_cols(header_cols)
+                tables_with_header.append(table_with_header)
         page.tables = tables_with_header
 
-        with TextExtractor(str(image_path.absolute()), seg_mode=PSM.SPARSE_TEXT) as extractor:
+        with stage('tesseract_page_text'):
             text_borders = [1]
             for table in page.tables:
                 _, y, _, y2 = table.bbox.box
@@ -516,10 +640,17 @@ class PageProcessor:
                         )
                     )
             for box in text_candidate_boxes:
-                text, _ = extractor.extract(
-                    box.top_left_x, box.top_left_y,
-                    box.width, box.height
-                )
+                layer_fields = [text_field for text_field in text_fields if box_contains_center(box, text_field)]
+                if planner is not None and not planner.needs_ocr(box, layer_fields):
+                    text = text_fields_to_text(layer_fields)
+                elif self.ocr_mode == OCR_MODE_WORDS:
+                    text = words_to_text(page_ocr.words_in(box, seg_mode=PSM.SPARSE_TEXT))
+                else:
+                    text, _ = page_ocr.extract(
+                        box.top_left_x, box.top_left_y,
+                        box.width, box.height,
+                        seg_mode=PSM.SPARSE_TEXT
+                    )
                 if text:
                     page.text.append(TextField(box, text))
 
@@ -529,6 +660,11 @@ class PageProcessor:
         self.visualizer.draw_object_and_save(img,
                                              page.tables,
                                              output_path.joinpath('tables').joinpath(image_path.name))
+        if planner is not None:
+            logger.info("Page %s: OCR avoided for %s of %s rectangles", page.page_num, planner.avoided,
+                        planner.planned)
+        if self.ocr_pool.ocr_cache is not None:
+            logger.debug("OCR cache after page %s: %s", page.page_num, self.ocr_pool.ocr_cache.stats())
         page_dict = page_to_dict(page)
         if self.visualizer.should_visualize:
             save_page(page_dict, output_path / 'pages' / f"{page.page_num}.json")
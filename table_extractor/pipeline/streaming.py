@@ -0,0 +1,158 @@
+import logging
+import queue
+import threading
+from pathlib import Path
+from typing import Dict, Any, Iterator, Callable, Optional, TYPE_CHECKING
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from table_extractor.cache_service.result_cache import hash_pdf
+from table_extractor.pdf_service.pdf_to_image import get_images_dir
+from table_extractor.poppler_service.poppler_text_extractor import open_document, PopplerTextSource
+
+if TYPE_CHECKING:
+    from table_extractor.pipeline.pipeline import PageProcessor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 2
+# Timeout to periodically check whether pipeline was stopped while blocked on a queue
+QUEUE_POLL_TIMEOUT = 0.5
+
+
+@dataclass
+class PageTask:
+    page_num: int
+    image_path: Path
+    img: Optional[np.ndarray] = None
+    inference_result: Optional[Any] = None
+    page: Optional[Dict[str, Any]] = None
+    document_hash: Optional[str] = None
+
+
+class _StageError:
+    def __init__(self, stage: str, error: BaseException):
+        self.stage = stage
+        self.error = error
+
+
+_END_OF_STREAM = object()
+
+
+class StreamingPipeline:
+    """
+    Runs page rendering, Cascade inference and table structure/OCR as producer/consumer stages
+    connected with bounded queues. Rendering and inference run in their own threads, poppler text of a page
+    is read lazily by the processing stage on the consuming thread right before the page is processed.
+    At most 2 * queue_size + 3 rendered pages are kept in memory at once: queue_size per queue plus one in each stage.
+    """
+    def __init__(self, page_processor: "PageProcessor", queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.page_processor = page_processor
+        self.queue_size = queue_size
+        self._stop = threading.Event()
+
+    def _put(self, out_queue: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=QUEUE_POLL_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, in_queue: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return in_queue.get(timeout=QUEUE_POLL_TIMEOUT)
+            except queue.Empty:
+                continue
+        return _END_OF_STREAM
+
+    def _render_stage(self, pdf_path: Path, images_dir: Path, out_queue: queue.Queue):
+        try:
+            pdf_document = open_document(pdf_path)
+            document_hash = hash_pdf(pdf_path) if self.page_processor.result_cache else None
+            logger.info("Streaming %s pages of %s", pdf_document.pages, pdf_path.name)
+            for page_num in range(pdf_document.pages):
+                cached_page = self.page_processor.get_cached_page(document_hash, page_num)
+                if cached_page is not None:
+                    # Cached pages skip rendering, detection and processing
+                    if not self._put(out_queue, PageTask(page_num, images_dir / f"{page_num}.png", page=cached_page)):
+                        return
+                    continue
+                image_path, img = self.page_processor.render_page(pdf_document, page_num, images_dir)
+                task = PageTask(
+                    page_num=page_num,
+                    image_path=image_path,
+                    img=img,
+                    document_hash=document_hash
+                )
+                if not self._put(out_queue, task):
+                    return
+        except Exception as e:
+            self._put(out_queue, _StageError('render', e))
+            return
+        self._put(out_queue, _END_OF_STREAM)
+
+    def _pass_stage(self, stage: str, func: Callable[[PageTask], None], in_queue: queue.Queue, out_queue: queue.Queue):
+        while True:
+            item = self._get(in_queue)
+            if item is _END_OF_STREAM or isinstance(item, _StageError):
+                self._put(out_queue, item)
+                return
+            try:
+                func(item)
+            except Exception as e:
+                self._put(out_queue, _StageError(stage, e))
+                return
+            if not self._put(out_queue, item):
+                return
+
+    def _detect(self, task: PageTask):
+        if task.page is not None:
+            return
+        task.inference_result = self.page_processor.inference_service.inference_image(task.image_path, image=task.img)
+
+    def process_pdf(self, pdf_path: Path, output_dir: Path) -> Iterator[Dict[str, Any]]:
+        """
+        Yields processed pages in page order as soon as each of them is ready
+        """
+        self._stop.clear()
+        images_dir = get_images_dir(pdf_path, output_dir)
+        # Text is extracted by the processing stage right before the page is processed and is not kept in queues
+        text_source = PopplerTextSource(pdf_path)
+        rendered: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        detected: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stages = [
+            threading.Thread(target=self._render_stage, args=(pdf_path, images_dir, rendered),
+                             name='render', daemon=True),
+            threading.Thread(target=self._pass_stage, args=('detect', self._detect, rendered, detected),
+                             name='detect', daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            while True:
+                item = self._get(detected)
+                if item is _END_OF_STREAM:
+                    break
+                if isinstance(item, _StageError):
+                    logger.warning("Stage %s failed: %s", item.stage, str(item.error))
+                    raise item.error
+                if item.page is not None:
+                    yield item.page
+                    continue
+                page = self.page_processor.process_page(item.image_path,
+                                                        images_dir.parent,
+                                                        text_source[item.page_num],
+                                                        inference_result=item.inference_result,
+                                                        img=item.img)
+                self.page_processor.cache_page(item.document_hash, item.page_num, page)
+                yield page
+        finally:
+            self._stop.set()
+            for stage in stages:
+                stage.join()
+            text_source.close()
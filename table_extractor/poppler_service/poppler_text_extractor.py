@@ -1,9 +1,10 @@
 import logging
+import threading
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Iterator, Mapping, Union
 
 from dataclasses import dataclass
-from poppler import load_from_file
+from poppler import load_from_file, load_from_data
 
 from table_extractor.model.table import BorderBox, TextField
 
@@ -48,35 +49,89 @@ def poppler_text_field_to_text_field(pt_field: PopplerTextField, scale: float):
     )
 
 
-def extract_text(pdf_file: Path) -> Dict[str, PopplerPage]:
-    pdf_document = load_from_file(pdf_file.absolute())
-    logger.info("Text extraction for: %s, pages %s", pdf_file.name, pdf_document.pages)
-    pages = {}
-    for page_num in range(pdf_document.pages):
-        logger.debug("Processing page %s", page_num)
-        page = pdf_document.create_page(page_num)
-        page_rect = page.page_rect()
-        text_fields: List[PopplerTextField] = []
-        for text_field in page.text_list():
-            text_fields.append(
-                PopplerTextField(
-                    bbox=PopplerBoundingBox(
-                        x=text_field.bbox.x,
-                        y=text_field.bbox.y,
-                        height=text_field.bbox.height,
-                        width=text_field.bbox.width
-                    ),
-                    text=text_field.text))
-        pages[str(page_num)] = PopplerPage(
-            bbox=PopplerBoundingBox(
-                x=page_rect.x,
-                y=page_rect.y,
-                height=page_rect.width if page.orientation == page.Orientation.landscape else page_rect.height,
-                width=page_rect.height if page.orientation == page.Orientation.landscape else page_rect.width
-            ),
-            page_num=page_num,
-            orientation=str(page.orientation),
-            text_fields=text_fields
-        )
-    logger.info("Text extraction for: %s done", pdf_file.name)
-    return pages
+def open_document(pdf_file: Path):
+    return load_from_file(pdf_file.absolute())
+
+
+def open_document_from_data(pdf_data: bytes):
+    return load_from_data(pdf_data)
+
+
+def extract_page_text(pdf_document, page_num: int) -> PopplerPage:
+    logger.debug("Processing page %s", page_num)
+    page = pdf_document.create_page(page_num)
+    page_rect = page.page_rect()
+    text_fields: List[PopplerTextField] = []
+    for text_field in page.text_list():
+        text_fields.append(
+            PopplerTextField(
+                bbox=PopplerBoundingBox(
+                    x=text_field.bbox.x,
+                    y=text_field.bbox.y,
+                    height=text_field.bbox.height,
+                    width=text_field.bbox.width
+                ),
+                text=text_field.text))
+    return PopplerPage(
+        bbox=PopplerBoundingBox(
+            x=page_rect.x,
+            y=page_rect.y,
+            height=page_rect.width if page.orientation == page.Orientation.landscape else page_rect.height,
+            width=page_rect.height if page.orientation == page.Orientation.landscape else page_rect.width
+        ),
+        page_num=page_num,
+        orientation=str(page.orientation),
+        text_fields=text_fields
+    )
+
+
+class PopplerTextSource(Mapping[str, PopplerPage]):
+    """
+    Page indexed text of pdf document, text of a page is extracted on every access and not kept,
+    so memory doesn't grow with the number of pages.
+    Document stays open between accesses, access is serialized with a lock as poppler document isn't thread safe.
+    Source can be pickled to worker processes, every process opens its own document handle.
+    """
+    def __init__(self, pdf_file: Path):
+        self.pdf_file = pdf_file
+        self._document = None
+        self._lock = threading.Lock()
+
+    def _get_document(self):
+        if self._document is None:
+            self._document = open_document(self.pdf_file)
+        return self._document
+
+    def __getitem__(self, page_num: Union[str, int]) -> PopplerPage:
+        page_num = int(page_num)
+        with self._lock:
+            document = self._get_document()
+            if not 0 <= page_num < document.pages:
+                raise KeyError(page_num)
+            return extract_page_text(document, page_num)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._get_document().pages
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(page_num) for page_num in range(len(self)))
+
+    def close(self):
+        with self._lock:
+            self._document = None
+
+    def __getstate__(self):
+        return {'pdf_file': self.pdf_file}
+
+    def __setstate__(self, state):
+        self.__init__(state['pdf_file'])
+
+
+def extract_text(pdf_file: Path) -> PopplerTextSource:
+    """
+    Text of every page of the document, pages are extracted lazily on access
+    """
+    text_source = PopplerTextSource(pdf_file)
+    logger.info("Text source for: %s, pages %s", pdf_file.name, len(text_source))
+    return text_source
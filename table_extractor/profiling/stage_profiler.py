@@ -0,0 +1,130 @@
+import functools
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Callable
+
+import numpy as np
+
+STAGE_FIELDS = ('wall', 'cpu')
+# Directory of per page reports inside document output directory
+PROFILE_DIR = 'profile'
+
+_CURRENT_PROFILER: ContextVar[Optional["StageProfiler"]] = ContextVar('stage_profiler', default=None)
+
+
+class StageProfiler:
+    """
+    Accumulates wall and cpu time per pipeline stage and work counters of a single page.
+    Repeated stages are summed up, stages can be nested and then overlap.
+    """
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'wall': 0., 'cpu': 0., 'calls': 0})
+            stage['wall'] += time.perf_counter() - wall_start
+            stage['cpu'] += time.thread_time() - cpu_start
+            stage['calls'] += 1
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'stages': self.stages,
+            'counters': self.counters
+        }
+
+
+@contextmanager
+def profile(profiler: StageProfiler):
+    """
+    Make profiler current for the code running in this context
+    """
+    token = _CURRENT_PROFILER.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _CURRENT_PROFILER.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    profiler = _CURRENT_PROFILER.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def count(name: str, value: int = 1):
+    profiler = _CURRENT_PROFILER.get()
+    if profiler is not None:
+        profiler.count(name, value)
+
+
+def profiled(name: str) -> Callable:
+    """
+    Decorator recording every call of a function as a stage of the current profiler
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _CURRENT_PROFILER.get()
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    return {
+        'total': float(np.sum(values)),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+    }
+
+
+def aggregate_reports(reports: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aggregate per page reports into per document total, p50 and p95, pages without a stage count as zero
+    """
+    stage_names = sorted({name for report in reports for name in report['stages']})
+    counter_names = sorted({name for report in reports for name in report['counters']})
+    if not reports:
+        return {'pages': 0, 'stages': {}, 'counters': {}}
+    return {
+        'pages': len(reports),
+        'stages': {
+            name: {
+                field: _percentiles([report['stages'].get(name, {}).get(field, 0.) for report in reports])
+                for field in STAGE_FIELDS
+            }
+            for name in stage_names
+        },
+        'counters': {
+            name: _percentiles([report['counters'].get(name, 0) for report in reports])
+            for name in counter_names
+        }
+    }
+
+
+def load_reports(profile_dir: Path) -> List[Dict[str, Any]]:
+    reports = []
+    for report_path in sorted(profile_dir.glob("*.json"), key=lambda x: int(x.name.split(".")[0])):
+        with open(str(report_path.absolute()), 'r') as f:
+            reports.append(json.load(f))
+    return reports
@@ -1,16 +1,29 @@
 import json
 import logging
+import multiprocessing
 import sys
 import os
+import shutil
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Any, Optional, Tuple, TYPE_CHECKING
 
 import click
 
-from table_extractor.cascade_rcnn_service.inference import CascadeRCNNInferenceService
-from table_extractor.paddle_service.text_detector import PaddleSwitchWrapper
-from table_extractor.pipeline.pipeline import PageProcessor, pdf_preprocess
-from table_extractor.visualization.table_visualizer import TableVisualizer
+from table_extractor.cache_service.result_cache import PageResultCache, config_hash, hash_pdf, \
+    DEFAULT_MAX_SIZE_BYTES
+from table_extractor.extraction_service.batcher import InferenceBatcher, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS
+from table_extractor.pdf_service.pdf_to_image import get_images_dir, DPI
+from table_extractor.pipeline.batch import BatchManifest, list_batch_documents, document_output_root, STATUS_DONE, \
+    STATUS_FAILED
+from table_extractor.pipeline.streaming import StreamingPipeline, DEFAULT_QUEUE_SIZE
+from table_extractor.poppler_service.poppler_text_extractor import open_document
+from table_extractor.profiling.stage_profiler import aggregate_reports, load_reports, PROFILE_DIR
+
+# Page processing with its models is imported when a command runs, so --help and the cache/batch
+# bookkeeping don't pay for torch, paddle, tesseract and nltk imports
+if TYPE_CHECKING:
+    from table_extractor.pipeline.pipeline import PageProcessor
+    from table_extractor.tesseract_service.ocr_cache import OcrCache
 
 LOGGER = logging.getLogger(__name__)
 
@@ -24,6 +37,23 @@ PADDLE_MODEL_DIR = Path(os.environ.get("PADDLE_MODEL_DIR")) if os.environ.get("P
     else Path(__file__).parent.parent.joinpath("models/ch_ppocr_mobile_v2.0_det_infer")
 PADDLE_MODEL_CLS = Path(os.environ.get("PADDLE_MODEL_CLS")) if os.environ.get("PADDLE_MODEL_CLS") \
     else Path(__file__).parent.parent.joinpath("models/ch_ppocr_mobile_v2.0_cls_infer")
+RESULT_CACHE_DIR = Path(os.environ.get("RESULT_CACHE_DIR")) if os.environ.get("RESULT_CACHE_DIR") \
+    else Path(__file__).parent.parent.joinpath("cache/results")
+RESULT_CACHE_MAX_SIZE = int(os.environ.get("RESULT_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE_BYTES))
+# cells - tesseract call per cell, words - one tesseract pass per page with words assigned to cells
+OCR_MODE = os.environ.get("OCR_MODE", "cells")
+# 1 - skip tesseract for blank cells and cells covered by pdf text layer, OCR results change
+OCR_PLANNER = os.environ.get("OCR_PLANNER", "0") != "0"
+# 1 - recognize single line cells of numeric columns as a line of digits and number punctuation
+OCR_NUMERIC = os.environ.get("OCR_NUMERIC", "0") != "0"
+# 0 - tesseract adaptive learning off, cells of a page are recognized by several threads, OCR results change
+OCR_LEARNING = os.environ.get("OCR_LEARNING", "1") != "0"
+# Pages rendered with DPI are downscaled to this resolution for tesseract, 0 - recognize them with DPI
+OCR_RESOLUTION = int(os.environ.get("OCR_RESOLUTION", 300))
+# Tesseract results of crops kept in memory, 0 disables OCR cache
+OCR_CACHE_SIZE = int(os.environ.get("OCR_CACHE_SIZE", 100000))
+# Optional directory persisting tesseract results between runs
+OCR_CACHE_DIR = Path(os.environ.get("OCR_CACHE_DIR")) if os.environ.get("OCR_CACHE_DIR") else None
 
 
 def save_document(document: Dict, path: Path):
@@ -32,6 +62,20 @@ def save_document(document: Dict, path: Path):
         f.write(json.dumps(document, indent=4))
 
 
+def clear_profile(output_path: Path, pdf_path: Path):
+    profile_dir = output_path / pdf_path.name / PROFILE_DIR
+    if profile_dir.exists():
+        shutil.rmtree(str(profile_dir.absolute()))
+
+
+def save_profile(output_path: Path, pdf_path: Path):
+    """
+    Aggregate per page stage reports saved by PageProcessor into per document report
+    """
+    reports = load_reports(output_path / pdf_path.name / PROFILE_DIR)
+    save_document(aggregate_reports(reports), output_path / pdf_path.name / 'profile.json')
+
+
 def configure_logging():
     formatter = logging.Formatter(LOGGING_FORMAT)
     console_handler = logging.StreamHandler(stream=sys.stdout)
@@ -48,23 +92,83 @@ def run_pipeline():
     pass
 
 
-def run_pipeline_sequentially(pdf_path: Path, output_dir: Path, should_visualize: bool, paddle_on: bool):
+def init_result_cache(paddle_on: bool) -> PageResultCache:
+    from table_extractor.cascade_rcnn_service.inference import DEFAULT_THRESHOLD
+
+    LOGGER.info("Initializing result cache in %s", RESULT_CACHE_DIR)
+    config_key = config_hash(
+        [CASCADE_CONFIG_PATH, CASCADE_MODEL_PATH],
+        {
+            'paddle_on': bool(paddle_on),
+            'paddle_model': PADDLE_MODEL_DIR.name,
+            'dpi': DPI,
+            'threshold': DEFAULT_THRESHOLD,
+            'ocr_mode': OCR_MODE,
+            'ocr_planner': OCR_PLANNER,
+            'ocr_numeric': OCR_NUMERIC,
+            'ocr_learning': OCR_LEARNING,
+            'ocr_resolution': OCR_RESOLUTION
+        }
+    )
+    return PageResultCache(RESULT_CACHE_DIR, config_key, RESULT_CACHE_MAX_SIZE)
+
+
+def init_ocr_cache() -> "Optional[OcrCache]":
+    from tesserocr import tesseract_version
+    from table_extractor.tesseract_service.ocr_cache import OcrCache
+
+    if not OCR_CACHE_SIZE:
+        return None
+    LOGGER.info("Initializing OCR cache for %s results in memory and %s on disk", OCR_CACHE_SIZE, OCR_CACHE_DIR)
+    return OcrCache(OCR_CACHE_SIZE, OCR_CACHE_DIR, namespace=tesseract_version())
+
+
+def init_page_processor(should_visualize: bool,
+                        paddle_on: bool,
+                        num_threads: Optional[int] = None,
+                        use_cache: bool = False,
+                        profile: bool = False) -> "PageProcessor":
+    from table_extractor.cascade_rcnn_service.inference import CascadeRCNNInferenceService
+    from table_extractor.paddle_service.text_detector import PaddleSwitchWrapper
+    from table_extractor.pipeline.pipeline import PageProcessor
+    from table_extractor.visualization.table_visualizer import TableVisualizer
+
     LOGGER.info("Initializing CascadeMaskRCNN with config: %s and model: %s", CASCADE_CONFIG_PATH, CASCADE_MODEL_PATH)
-    cascade_rcnn_detector = CascadeRCNNInferenceService(CASCADE_CONFIG_PATH, CASCADE_MODEL_PATH, should_visualize)
+    cascade_rcnn_detector = CascadeRCNNInferenceService(CASCADE_CONFIG_PATH, CASCADE_MODEL_PATH, should_visualize,
+                                                        num_threads=num_threads)
 
     LOGGER.info("Initializing Paddle with model_dir: %s and model_cls: %s, paddle mode: %s",
                 PADDLE_MODEL_DIR, PADDLE_MODEL_CLS, paddle_on)
     paddle_detector = PaddleSwitchWrapper(PADDLE_MODEL_DIR, PADDLE_MODEL_CLS, paddle_on)
     LOGGER.info("Visualizer should_visualize set to: %s", should_visualize)
     visualizer = TableVisualizer(should_visualize)
-    page_processor = PageProcessor(
+    # Cached results have no visualization and stage reports, so cache is bypassed in verbose and profile modes
+    result_cache = init_result_cache(paddle_on) if use_cache and not should_visualize and not profile else None
+    return PageProcessor(
         cascade_rcnn_detector,
         paddle_detector,
         visualizer,
-        paddle_on
+        paddle_on,
+        result_cache,
+        profile,
+        ocr_threads=num_threads,
+        ocr_mode=OCR_MODE,
+        plan_ocr=OCR_PLANNER,
+        ocr_cache=init_ocr_cache() if use_cache else None,
+        numeric_ocr=OCR_NUMERIC,
+        ocr_learning=OCR_LEARNING,
+        ocr_resolution=OCR_RESOLUTION or None
     )
-    images_path, poppler_pages = pdf_preprocess(pdf_path, output_dir)
-    pages = page_processor.process_pages(images_path, poppler_pages)
+
+
+def run_pipeline_sequentially(pdf_path: Path, output_dir: Path, should_visualize: bool, paddle_on: bool,
+                              use_cache: bool = False, profile: bool = False):
+    page_processor = init_page_processor(should_visualize, paddle_on, use_cache=use_cache, profile=profile)
+    if profile:
+        clear_profile(output_dir, pdf_path)
+    pages = page_processor.process_pdf(pdf_path, output_dir)
+    if profile:
+        save_profile(output_dir, pdf_path)
     document = {
         'doc_name': str(pdf_path.name),
         'pages': pages
@@ -73,8 +177,123 @@ def run_pipeline_sequentially(pdf_path: Path, output_dir: Path, should_visualize
     return document
 
 
-def run_sequentially_and_save(pdf_path, output_path, verbose, paddle_on):
-    save_document(run_pipeline_sequentially(Path(pdf_path), Path(output_path), verbose, paddle_on),
+def run_pipeline_streaming(pdf_path: Path, output_dir: Path, should_visualize: bool, paddle_on: bool,
+                           queue_size: int = DEFAULT_QUEUE_SIZE, use_cache: bool = False):
+    from table_extractor.pipeline.pipeline import save_page
+
+    page_processor = init_page_processor(should_visualize, paddle_on, use_cache=use_cache)
+    streaming_pipeline = StreamingPipeline(page_processor, queue_size=queue_size)
+    pages = []
+    for page in streaming_pipeline.process_pdf(pdf_path, output_dir):
+        LOGGER.info("Page %s of %s is ready", page['page_num'], pdf_path.name)
+        if not should_visualize:
+            # Visualizer already saves every page
+            save_page(page, output_dir / pdf_path.name / 'pages' / f"{page['page_num']}.json")
+        pages.append(page)
+    document = {
+        'doc_name': str(pdf_path.name),
+        'pages': pages
+    }
+
+    return document
+
+
+# Page processor of the current worker process, models are loaded once per worker by _init_page_worker
+_WORKER_PAGE_PROCESSOR: Optional["PageProcessor"] = None
+# Pdf documents opened by the current worker process
+_WORKER_DOCUMENTS: Dict[Path, Any] = {}
+
+
+def _init_page_worker(worker_count, should_visualize: bool, paddle_on: bool, num_threads: int, use_cache: bool,
+                      profile: bool):
+    from table_extractor.model.table import set_box_ids_worker
+
+    global _WORKER_PAGE_PROCESSOR
+    with worker_count.get_lock():
+        worker_count.value += 1
+        set_box_ids_worker(worker_count.value)
+    configure_logging()
+    _WORKER_PAGE_PROCESSOR = init_page_processor(should_visualize, paddle_on, num_threads, use_cache, profile)
+
+
+def _process_page_in_worker(task: Tuple[Path, int, Path, Optional[str]]) -> Dict[str, Any]:
+    pdf_path, page_num, images_path, document_hash = task
+    if pdf_path not in _WORKER_DOCUMENTS:
+        _WORKER_DOCUMENTS[pdf_path] = open_document(pdf_path)
+    # Every worker renders its own pages, so page images are never sent between processes
+    return _WORKER_PAGE_PROCESSOR.process_document_page(_WORKER_DOCUMENTS[pdf_path], page_num, images_path,
+                                                        document_hash)
+
+
+def run_pipeline_parallel(pdf_path: Path, output_dir: Path, should_visualize: bool, paddle_on: bool, workers: int,
+                          use_cache: bool = False, profile: bool = False):
+    if profile:
+        clear_profile(output_dir, pdf_path)
+    images_path = get_images_dir(pdf_path, output_dir)
+    document_hash = hash_pdf(pdf_path) if use_cache else None
+    tasks = [(pdf_path, page_num, images_path, document_hash)
+             for page_num in range(open_document(pdf_path).pages)]
+    workers = max(1, min(workers, len(tasks)))
+    # Split CPU between workers to not oversubscribe cores with torch intra-op threads
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    LOGGER.info("Processing %s pages with %s workers", len(tasks), workers)
+    # Spawn is used because torch and paddle are not fork-safe
+    context = multiprocessing.get_context("spawn")
+    # Workers are numbered from 1 to prefix ids of their boxes
+    worker_count = context.Value('i', 0)
+    with context.Pool(workers,
+                      initializer=_init_page_worker,
+                      initargs=(worker_count, should_visualize, paddle_on, num_threads, use_cache, profile)) as pool:
+        # map keeps pages in the same order as sequential processing
+        pages = pool.map(_process_page_in_worker, tasks, chunksize=1)
+    if profile:
+        save_profile(output_dir, pdf_path)
+    document = {
+        'doc_name': str(pdf_path.name),
+        'pages': pages
+    }
+
+    return document
+
+
+def run_sequentially_and_save(pdf_path, output_path, verbose, paddle_on, use_cache=False, profile=False):
+    save_document(run_pipeline_sequentially(Path(pdf_path), Path(output_path), verbose, paddle_on, use_cache,
+                                            profile),
+                  Path(output_path) / Path(pdf_path).name / 'document.json')
+
+
+@run_pipeline.command()
+@click.argument('pdf_path')
+@click.argument('output_path')
+@click.option('--verbose', type=bool)
+@click.option('--paddle_on', type=bool)
+@click.option('--no_cache', is_flag=True, help='Process all pages from scratch ignoring cached results')
+@click.option('--profile', is_flag=True, help='Save per page stage timings and work counters with p50/p95 summary')
+def run_sequentially(pdf_path, output_path, verbose, paddle_on, no_cache, profile):
+    run_sequentially_and_save(pdf_path, output_path, verbose, paddle_on, not no_cache, profile)
+
+
+def run_parallel_and_save(pdf_path, output_path, verbose, paddle_on, workers, use_cache=False, profile=False):
+    save_document(run_pipeline_parallel(Path(pdf_path), Path(output_path), verbose, paddle_on, workers, use_cache,
+                                        profile),
+                  Path(output_path) / Path(pdf_path).name / 'document.json')
+
+
+@run_pipeline.command()
+@click.argument('pdf_path')
+@click.argument('output_path')
+@click.option('--verbose', type=bool)
+@click.option('--paddle_on', type=bool)
+@click.option('--workers', type=int, default=os.cpu_count(), help='Number of page worker processes')
+@click.option('--no_cache', is_flag=True, help='Process all pages from scratch ignoring cached results')
+@click.option('--profile', is_flag=True, help='Save per page stage timings and work counters with p50/p95 summary')
+def run_parallel(pdf_path, output_path, verbose, paddle_on, workers, no_cache, profile):
+    run_parallel_and_save(pdf_path, output_path, verbose, paddle_on, workers, not no_cache, profile)
+
+
+def run_streaming_and_save(pdf_path, output_path, verbose, paddle_on, queue_size, use_cache=False):
+    save_document(run_pipeline_streaming(Path(pdf_path), Path(output_path), verbose, paddle_on, queue_size,
+                                         use_cache),
                   Path(output_path) / Path(pdf_path).name / 'document.json')
 
 
@@ -83,8 +302,77 @@ def run_sequentially_and_save(pdf_path, output_path, verbose, paddle_on):
 @click.argument('output_path')
 @click.option('--verbose', type=bool)
 @click.option('--paddle_on', type=bool)
-def run_sequentially(pdf_path, output_path, verbose, paddle_on):
-    run_sequentially_and_save(pdf_path, output_path, verbose, paddle_on)
+@click.option('--queue_size', type=int, default=DEFAULT_QUEUE_SIZE,
+              help='Max number of pages waiting between render, detection and processing stages')
+@click.option('--no_cache', is_flag=True, help='Process all pages from scratch ignoring cached results')
+def run_streaming(pdf_path, output_path, verbose, paddle_on, queue_size, no_cache):
+    run_streaming_and_save(pdf_path, output_path, verbose, paddle_on, queue_size, not no_cache)
+
+
+def run_batch_and_save(source: Path, output_path: Path, should_visualize: bool, paddle_on: bool,
+                       use_cache: bool = False, profile: bool = False):
+    documents = list_batch_documents(source)
+    manifest = BatchManifest(output_path)
+    to_process = [pdf_path for pdf_path in documents if not manifest.is_done(pdf_path)]
+    LOGGER.info("Batch of %s documents, %s already done", len(documents), len(documents) - len(to_process))
+    if not to_process:
+        return
+    # Models are loaded once for the whole batch
+    page_processor = init_page_processor(should_visualize, paddle_on, use_cache=use_cache, profile=profile)
+    for idx, pdf_path in enumerate(to_process):
+        LOGGER.info("Processing document %s/%s: %s", idx + 1, len(to_process), pdf_path)
+        # Documents with the same name from different directories don't overwrite each other
+        document_root = document_output_root(source, pdf_path, output_path)
+        output_dir = document_root / pdf_path.name
+        document_path = output_dir / 'document.json'
+        try:
+            if profile:
+                clear_profile(document_root, pdf_path)
+            pages = page_processor.process_pdf(pdf_path, document_root)
+            save_document({'doc_name': str(pdf_path.name), 'pages': pages}, document_path)
+            if profile:
+                save_profile(document_root, pdf_path)
+        except Exception as e:
+            LOGGER.warning("Document %s failed: %s", pdf_path, str(e))
+            manifest.record(pdf_path, STATUS_FAILED, error=str(e), output_dir=output_dir)
+            continue
+        manifest.record(pdf_path, STATUS_DONE, document_path, output_dir=output_dir)
+
+
+@run_pipeline.command()
+@click.argument('source')
+@click.argument('output_path')
+@click.option('--verbose', type=bool)
+@click.option('--paddle_on', type=bool)
+@click.option('--no_cache', is_flag=True, help='Process all pages from scratch ignoring cached results')
+@click.option('--profile', is_flag=True, help='Save per page stage timings and work counters with p50/p95 summary')
+def run_batch(source, output_path, verbose, paddle_on, no_cache, profile):
+    """
+    Process directory of pdf files or jsonl manifest with {"pdf_path": ...} lines,
+    interrupted batch resumes from batch_manifest.jsonl in OUTPUT_PATH
+    """
+    run_batch_and_save(Path(source), Path(output_path), verbose, paddle_on, not no_cache, profile)
+
+
+@run_pipeline.command()
+@click.argument('work_dir')
+@click.option('--host', type=str, default='127.0.0.1')
+@click.option('--port', type=int, default=8080)
+@click.option('--paddle_on', type=bool)
+@click.option('--max_batch_size', type=int, default=DEFAULT_MAX_BATCH_SIZE,
+              help='Max number of pages in one Cascade inference batch')
+@click.option('--max_wait_ms', type=int, default=DEFAULT_MAX_WAIT_MS,
+              help='Max time to wait for a batch to fill up')
+@click.option('--no_cache', is_flag=True, help='Process all pages from scratch ignoring cached results')
+def run_server(work_dir, host, port, paddle_on, max_batch_size, max_wait_ms, no_cache):
+    """
+    Serve POST /extract?name=<doc-name> with pdf in request body and GET /stats
+    """
+    from table_extractor.extraction_service.server import ExtractionService, serve
+
+    page_processor = init_page_processor(False, paddle_on, use_cache=not no_cache)
+    batcher = InferenceBatcher(page_processor.inference_service, max_batch_size, max_wait_ms)
+    serve(ExtractionService(page_processor, batcher, Path(work_dir)), host, port)
 
 
 if __name__ == '__main__':
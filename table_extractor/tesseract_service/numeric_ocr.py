@@ -0,0 +1,135 @@
+from typing import List, Optional, Dict, Tuple
+
+import numpy as np
+from tesserocr import PSM
+
+from table_extractor.model.table import StructuredTable, CellLinked
+from table_extractor.profiling.stage_profiler import count
+from table_extractor.tesseract_service.ocr_cache import crop_image
+from table_extractor.tesseract_service.tesseract_extractor import PageTextExtractor
+
+# Characters of numbers in financial and clinical tables
+NUMERIC_WHITELIST = "0123456789.,-+()%$€£"
+# Known cell texts of a column needed to classify it, missing ones are taken from first recognized cells
+NUMERIC_MIN_SAMPLES = 3
+# Share of numbers among known texts of a numeric column, dashes of empty values make the rest
+NUMERIC_COLUMN_SHARE = 0.75
+# Gray levels below this are ink
+INK_THRESHOLD = 128
+# Blank pixel rows separating two text lines of a cell
+LINE_GAP = 2
+# Pixel rows inked over this share of the cell width are table rules, not text
+RULE_SHARE = 0.9
+
+
+def parse_number(text: str) -> Optional[float]:
+    """
+    Parse cell text as float the way HeaderChecker.get_cell_score does,
+    also accepting thousands separators, currency and percent signs and negatives in parentheses
+    """
+    value = text.strip()
+    if not any(char.isdigit() for char in value):
+        return None
+    negative = value.startswith('(') and value.endswith(')')
+    value = value.strip('()').strip('$€£%').replace(',', '').strip()
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return -number if negative else number
+
+
+def is_whitelisted(text: str) -> bool:
+    return all(char in NUMERIC_WHITELIST or char.isspace() for char in text)
+
+
+def is_numeric_column(texts: List[str]) -> Optional[bool]:
+    """
+    Column is not numeric if any of its texts has characters whitelisted recognition would drop,
+    like "<0.001" or "12.3 ± 4.5"
+    @param texts: texts of cells below the first row
+    @return: None if there are not enough non empty texts to decide
+    """
+    texts = [text for text in texts if text.strip()]
+    if len(texts) < NUMERIC_MIN_SAMPLES:
+        return None
+    if not all(is_whitelisted(text) for text in texts):
+        return False
+    return sum(parse_number(text) is not None for text in texts) >= NUMERIC_COLUMN_SHARE * len(texts)
+
+
+def count_text_lines(crop: np.ndarray) -> int:
+    """
+    Number of text lines in a cell crop, rows of table rules are ignored
+    """
+    if not crop.size:
+        return 0
+    gray = crop if crop.ndim == 2 else crop.mean(axis=2)
+    ink = (gray < INK_THRESHOLD).sum(axis=1)
+    text_rows = np.flatnonzero((ink > 0) & (ink < RULE_SHARE * gray.shape[1]))
+    if not text_rows.size:
+        return 0
+    return 1 + int(np.count_nonzero(np.diff(text_rows) > LINE_GAP))
+
+
+def _cell_text(cell: CellLinked) -> str:
+    return " ".join(text_field.text for text_field in cell.text_boxes if text_field.text)
+
+
+def _rect(cell: CellLinked) -> Tuple[int, int, int, int]:
+    return cell.top_left_x, cell.top_left_y, cell.width, cell.height
+
+
+def recognize_cells(table: StructuredTable, cells: List[CellLinked], page_ocr: PageTextExtractor) -> List[str]:
+    """
+    Recognize cells of the table, single line cells of numeric columns below the first row are recognized
+    as a single line restricted to NUMERIC_WHITELIST.
+    Columns are classified by pdf text layer of their cells below the first row, first of these cells without
+    enough text layer are recognized as usual and classify it.
+    Cells with several text lines and whitelisted results which are not numbers are recognized as usual.
+    @param cells: cells of table to recognize
+    @return: text of every cell in cells order
+    """
+    if not cells:
+        return []
+    to_recognize = {id(cell) for cell in cells}
+    top_row = min(cell.row for cell in table.cells)
+    cols = table.cols
+    # Text layer of every column and its cells waiting for column classification
+    pending: List[Tuple[List[str], List[CellLinked]]] = []
+    for col in cols:
+        known = [_cell_text(cell) for cell in col if id(cell) not in to_recognize and cell.row != top_row]
+        known = [text for text in known if text]
+        body = [cell for cell in col if id(cell) in to_recognize and cell.row != top_row]
+        probes = max(0, NUMERIC_MIN_SAMPLES - len(known))
+        pending.append((known, body[probes:]))
+    waiting = {id(cell) for _, col_cells in pending for cell in col_cells}
+
+    texts: Dict[int, str] = {}
+    first = [cell for cell in cells if id(cell) not in waiting]
+    for cell, (text, _) in zip(first, page_ocr.extract_many([_rect(cell) for cell in first])):
+        texts[id(cell)] = text
+
+    numeric, regular = [], []
+    for col, (known, col_cells) in zip(cols, pending):
+        samples = known + [texts[id(cell)] for cell in col if id(cell) in texts and cell.row != top_row]
+        (numeric if is_numeric_column(samples) else regular).extend(col_cells)
+
+    # Single line segmentation would drop all lines but one
+    single_line, fallback = [], []
+    for cell in numeric:
+        lines = count_text_lines(crop_image(page_ocr.image, *_rect(cell)))
+        (single_line if lines == 1 else fallback).append(cell)
+    results = page_ocr.extract_many([_rect(cell) for cell in single_line], PSM.SINGLE_LINE, NUMERIC_WHITELIST)
+    for cell, (text, _) in zip(single_line, results):
+        if parse_number(text) is None:
+            fallback.append(cell)
+        else:
+            texts[id(cell)] = text
+    count('ocr_numeric_cells', len(numeric) - len(fallback))
+    count('ocr_numeric_fallbacks', len(fallback))
+
+    rest = regular + fallback
+    for cell, (text, _) in zip(rest, page_ocr.extract_many([_rect(cell) for cell in rest])):
+        texts[id(cell)] = text
+    return [texts[id(cell)] for cell in cells]
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate cached OCR results after changes in tesseract settings
+OCR_CACHE_VERSION = 1
+DEFAULT_MAX_ENTRIES = 100000
+
+# Kinds of cached results, extract and extract_region results are kept apart
+KIND_TEXT = 'text'
+KIND_REGIONS = 'regions'
+
+
+def crop_image(image: np.ndarray, x=None, y=None, w=None, h=None) -> np.ndarray:
+    """
+    Pixels tesseract sees for SetRectangle(x, y, w, h), rectangle is clipped to the image like tesseract does
+    """
+    if any([e is None for e in [x, y, w, h]]):
+        return image
+    return image[max(0, y):max(0, y + h), max(0, x):max(0, x + w)]
+
+
+class OcrCache:
+    """
+    Tesseract results keyed by crop pixels, page segmentation mode, character whitelist and source resolution,
+    so identical crops (page headers and footers, repeated table skeletons, reruns of a document)
+    are recognized once.
+    Least recently used entries are evicted from memory when it holds over max_entries results,
+    results are also written to cache_dir if it is set and read from it on memory misses.
+    """
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, cache_dir: Optional[Path] = None, namespace: str = ''):
+        """
+        @param namespace: tesseract version and language, results of other engines are not shared
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, crop: np.ndarray, seg_mode: int, kind: str, source_resolution: Optional[int] = None,
+            whitelist: Optional[str] = None) -> str:
+        sha = hashlib.sha256(
+            f"{OCR_CACHE_VERSION}:{self.namespace}:{kind}:{int(seg_mode)}:{source_resolution}:{whitelist}:"
+            f"{crop.shape}:{crop.dtype}:".encode('utf-8')
+        )
+        sha.update(np.ascontiguousarray(crop).data)
+        return sha.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(str(self._path(key).absolute()), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write(self, key: str, result: Dict[str, Any]):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(str(tmp_path.absolute()), 'w') as f:
+            json.dump(result, f)
+        os.replace(str(tmp_path.absolute()), str(path.absolute()))
+
+    def _remember(self, key: str, result: Dict[str, Any]):
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return result
+        result = self._read(key) if self.cache_dir is not None else None
+        if result is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        self._remember(key, result)
+        with self._lock:
+            self.disk_hits += 1
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        self._remember(key, result)
+        if self.cache_dir is not None:
+            self._write(key, result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.,
+                'memory_entries': len(self._memory),
+            }
+
+
+def text_result_to_dict(result: Tuple) -> Dict[str, Any]:
+    text, conf = result
+    return {'text': text, 'conf': conf}
+
+
+def text_result_from_dict(result: Dict[str, Any]) -> Tuple:
+    return result['text'], result['conf']
+
+
+def regions_result_to_dict(result: Tuple) -> Dict[str, Any]:
+    text, conf, regions = result
+    return {'text': text, 'conf': conf, 'regions': [box for _, box in regions] if regions else regions}
+
+
+def regions_result_from_dict(result: Dict[str, Any]) -> Tuple:
+    """
+    Region images are not cached, cached regions have None instead of image
+    """
+    regions: Optional[List] = result['regions']
+    return result['text'], result['conf'], [(None, box) for box in regions] if regions else regions
+
+
+# Converters of extract and extract_region results to json serializable cache entries and back
+RESULT_CODECS = {
+    KIND_TEXT: (text_result_to_dict, text_result_from_dict),
+    KIND_REGIONS: (regions_result_to_dict, regions_result_from_dict),
+}
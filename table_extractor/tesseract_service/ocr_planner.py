@@ -0,0 +1,96 @@
+import logging
+from typing import List, Tuple, Optional
+
+import cv2
+import numpy as np
+
+from table_extractor.model.table import BorderBox, TextField
+from table_extractor.profiling.stage_profiler import count
+
+logger = logging.getLogger(__name__)
+
+# Gray level below which pixel is considered ink
+INK_THRESHOLD = 128
+# Share of box width and height cut from each side before counting ink, so cell borders are not taken for text
+INTERIOR_MARGIN = 0.1
+# Boxes with less ink in the interior are blank
+MIN_INK_DENSITY = 0.005
+# Share of box ink allowed outside of pdf text layer boxes for the text layer to be used instead of OCR
+MAX_UNCOVERED_INK = 0.1
+
+
+def text_fields_to_text(text_fields: List[TextField]) -> str:
+    """
+    Join text layer words into lines by their vertical position, words of a line are ordered left to right
+    """
+    lines: List[Tuple[int, int, List[TextField]]] = []
+    for text_field in sorted(text_fields, key=lambda x: (x.bbox.top_left_y, x.bbox.top_left_x)):
+        center_y = (text_field.bbox.top_left_y + text_field.bbox.bottom_right_y) / 2
+        if lines and lines[-1][0] <= center_y <= lines[-1][1]:
+            lines[-1][2].append(text_field)
+        else:
+            lines.append((text_field.bbox.top_left_y, text_field.bbox.bottom_right_y, [text_field]))
+    return "".join(" ".join(field.text for field in sorted(line, key=lambda x: x.bbox.top_left_x)) + "\n"
+                   for _, _, line in lines)
+
+
+class OcrPlanner:
+    """
+    Decides for every rectangle of a page whether tesseract is needed:
+    blank rectangles and rectangles whose ink is covered by pdf text layer are not recognized
+    """
+    def __init__(self, img: np.ndarray):
+        self.img = img
+        self.avoided = 0
+        self.planned = 0
+        self._ink_integral: Optional[np.ndarray] = None
+
+    @property
+    def ink_integral(self) -> np.ndarray:
+        if self._ink_integral is None:
+            gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY) if self.img.ndim == 3 else self.img
+            self._ink_integral = cv2.integral((gray < INK_THRESHOLD).astype(np.uint8))
+        return self._ink_integral
+
+    def _clip(self, x1: int, y1: int, x2: int, y2: int) -> Tuple[int, int, int, int]:
+        height, width = self.img.shape[:2]
+        return max(0, min(x1, width)), max(0, min(y1, height)), max(0, min(x2, width)), max(0, min(y2, height))
+
+    def ink(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        x1, y1, x2, y2 = self._clip(x1, y1, x2, y2)
+        if x2 <= x1 or y2 <= y1:
+            return 0
+        integral = self.ink_integral
+        return int(integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1])
+
+    @staticmethod
+    def _interior(box: BorderBox) -> Tuple[int, int, int, int]:
+        x_margin = int(box.width * INTERIOR_MARGIN)
+        y_margin = int(box.height * INTERIOR_MARGIN)
+        return (box.top_left_x + x_margin, box.top_left_y + y_margin,
+                box.bottom_right_x - x_margin, box.bottom_right_y - y_margin)
+
+    def is_blank(self, box: BorderBox) -> bool:
+        x1, y1, x2, y2 = self._clip(*self._interior(box))
+        area = (x2 - x1) * (y2 - y1)
+        return area <= 0 or self.ink(x1, y1, x2, y2) < MIN_INK_DENSITY * area
+
+    def is_covered(self, box: BorderBox, text_boxes: List[BorderBox]) -> bool:
+        x1, y1, x2, y2 = self._interior(box)
+        total = self.ink(x1, y1, x2, y2)
+        covered = sum(self.ink(max(x1, tb.top_left_x), max(y1, tb.top_left_y),
+                               min(x2, tb.bottom_right_x + 1), min(y2, tb.bottom_right_y + 1))
+                      for tb in text_boxes)
+        return total - covered <= MAX_UNCOVERED_INK * total
+
+    def needs_ocr(self, box: BorderBox, text_fields: List[TextField]) -> bool:
+        """
+        @param text_fields: text found in the box so far, fields with text come from pdf text layer
+        """
+        self.planned += 1
+        layer_boxes = [text_field.bbox for text_field in text_fields if text_field.text]
+        if self.is_blank(box) or (layer_boxes and self.is_covered(box, layer_boxes)):
+            self.avoided += 1
+            count('ocr_avoided')
+            return False
+        return True
@@ -1,13 +1,92 @@
-from typing import Tuple
+import contextvars
+import functools
+import itertools
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Union, Optional, Dict, List, Callable, Any, Sequence
 
-from tesserocr import PyTessBaseAPI, PSM
+import cv2
+import numpy as np
+from tesserocr import PyTessBaseAPI, PSM, RIL, iterate_level
+
+from table_extractor.model.table import BorderBox, TextField, compact
+from table_extractor.profiling.stage_profiler import count
+from table_extractor.tesseract_service.ocr_cache import OcrCache, crop_image, KIND_TEXT, KIND_REGIONS, RESULT_CODECS
+from table_extractor.text_cells_matcher.text_cells_matcher import box_contains_center
+
+# Rectangles batches smaller than this are recognized by a single pool thread
+MIN_PARALLEL_RECTS = 8
+# Engines of different page segmentation modes and whitelists kept by a pool thread
+MAX_THREAD_ENGINES = 2
+
+# Every cell and text region is recognized with its own tesseract call
+OCR_MODE_CELLS = 'cells'
+# Page is recognized once, words are assigned to cells and text regions by their boxes
+OCR_MODE_WORDS = 'words'
+OCR_MODES = (OCR_MODE_CELLS, OCR_MODE_WORDS)
+
+
+@compact
+class OcrWord(TextField):
+    # Number of text line in page reading order
+    line: int = 0
+
+
+def words_to_text(words: List[OcrWord]) -> str:
+    """
+    Join words keeping their lines, formatted like GetUTF8Text of the same region
+    """
+    lines = []
+    prev_line = None
+    for word in words:
+        if word.line != prev_line:
+            lines.append([])
+            prev_line = word.line
+        lines[-1].append(word.text)
+    return "".join(" ".join(line) + "\n" for line in lines)
+
+
+def to_tesseract_image(image: np.ndarray) -> Tuple[bytes, int, int, int, int]:
+    """
+    Convert BGR or grayscale image buffer to SetImageBytes arguments
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    height, width = image.shape[:2]
+    bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+    return np.ascontiguousarray(image).tobytes(), width, height, bytes_per_pixel, bytes_per_pixel * width
+
+
+def set_image_array(api: PyTessBaseAPI, image: np.ndarray, source_resolution: Optional[int] = None):
+    """
+    Pass BGR or grayscale image buffer to tesseract without encoding it to file
+    """
+    api.SetImageBytes(*to_tesseract_image(image))
+    if source_resolution:
+        api.SetSourceResolution(source_resolution)
 
 
 class TextExtractor:
-    def __init__(self, image_path, seg_mode=PSM.SPARSE_TEXT):
+    def __init__(self, image: Union[str, np.ndarray], seg_mode=PSM.SPARSE_TEXT, source_resolution: Optional[int] = None,
+                 ocr_cache: Optional[OcrCache] = None):
+        """
+        @param ocr_cache: results of already recognized crops are taken from it, image file is read to compute
+        crop keys if image is a path
+        """
         self.api = PyTessBaseAPI()
         self.api.SetPageSegMode(seg_mode)
-        self.api.SetImageFile(image_path)
+        self.seg_mode = seg_mode
+        self.source_resolution = source_resolution
+        self.ocr_cache = ocr_cache
+        self._image = image if isinstance(image, np.ndarray) else None
+        self._image_path = None if isinstance(image, np.ndarray) else image
+        if isinstance(image, np.ndarray):
+            set_image_array(self.api, image, source_resolution)
+        else:
+            self.api.SetImageFile(image)
 
     def __enter__(self):
         return self
@@ -15,6 +94,27 @@ class TextExtractor:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    @property
+    def image(self) -> np.ndarray:
+        if self._image is None:
+            self._image = cv2.imread(self._image_path)
+        return self._image
+
+    def _cached(self, kind: str, rect: Tuple, recognize: Callable[[], Tuple]) -> Tuple:
+        if self.ocr_cache is None:
+            count('ocr_calls')
+            return recognize()
+        to_dict, from_dict = RESULT_CODECS[kind]
+        key = self.ocr_cache.key(crop_image(self.image, *rect), self.seg_mode, kind, self.source_resolution)
+        cached = self.ocr_cache.get(key)
+        if cached is not None:
+            count('ocr_cache_hits')
+            return from_dict(cached)
+        count('ocr_calls')
+        result = recognize()
+        self.ocr_cache.put(key, to_dict(result))
+        return result
+
     def _extract(self) -> Tuple:
         text = self.api.GetUTF8Text()
         conf = self.api.MeanTextConf()
@@ -27,16 +127,368 @@ class TextExtractor:
     #TODO: Add support of zero values
     def extract(self, x=None, y=None, w=None, h=None) -> Tuple:
         if all([e is not None for e in [x, y, w, h]]):
-            return self._extract_from_rect(x, y, w, h)
+            return self._cached(KIND_TEXT, (x, y, w, h), lambda: self._extract_from_rect(x, y, w, h))
         else:
-            return self._extract()
+            return self._cached(KIND_TEXT, (), self._extract)
 
-    def extract_region(self, x, y, w, h) -> Tuple:
+    def _extract_region(self, x, y, w, h) -> Tuple:
         self.api.SetRectangle(x, y, w, h)
         text = self.api.GetUTF8Text()
         conf = self.api.MeanTextConf()
         regions = self.api.GetRegions()
         return text, conf, regions
 
+    def extract_region(self, x, y, w, h) -> Tuple:
+        return self._cached(KIND_REGIONS, (x, y, w, h), lambda: self._extract_region(x, y, w, h))
+
     def close(self):
         self.api.End()
+
+
+class TesseractPool:
+    """
+    Initialised tesseract engines kept per thread, page segmentation mode and character whitelist,
+    so language data is loaded once per engine instead of once per TextExtractor.
+    Each of max_workers threads keeps at most MAX_THREAD_ENGINES engines, least recently used engine is ended
+    when another one is needed, so the pool holds at most max_workers * MAX_THREAD_ENGINES engines.
+    Engines are created only in the pool threads, so short lived callers like server request threads
+    don't leave engines behind.
+    With adaptive learning all rectangles of a page are recognized in order by the thread the page is assigned to
+    and adaptive classifier is cleared for every page, so results are the same as of a sequential loop over
+    a fresh engine per page, different pages are recognized in parallel.
+    Without adaptive learning results don't depend on rectangles recognized before, so batches of rectangles
+    of a page are split between threads, results differ from the ones with learning.
+    tesserocr releases GIL during recognition.
+    Results of crops found in ocr_cache are taken from it without recognition.
+    """
+    def __init__(self, max_workers: Optional[int] = None, ocr_cache: Optional[OcrCache] = None,
+                 adaptive_learning: bool = True):
+        """
+        @param adaptive_learning: tesseract adaptive classifier learning on recognized text of a page
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.ocr_cache = ocr_cache
+        self.adaptive_learning = adaptive_learning
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._apis: List[PyTessBaseAPI] = []
+        # Single thread executors, page is pinned to one of them
+        self._executors: List[ThreadPoolExecutor] = []
+
+    def get_api(self, seg_mode: PSM, whitelist: Optional[str] = None) -> PyTessBaseAPI:
+        """
+        @param whitelist: characters engine is restricted to, all characters if not set
+        """
+        apis: "OrderedDict[Tuple[PSM, Optional[str]], PyTessBaseAPI]" = getattr(self._local, 'apis', None)
+        if apis is None:
+            apis = self._local.apis = OrderedDict()
+            self._local.page_ids = {}
+        key = (seg_mode, whitelist)
+        if key not in apis:
+            if len(apis) >= MAX_THREAD_ENGINES:
+                self._end_api(*apis.popitem(last=False))
+            count('tesseract_inits')
+            api = PyTessBaseAPI(psm=seg_mode)
+            if not self.adaptive_learning:
+                api.SetVariable('classify_enable_learning', '0')
+            if whitelist:
+                api.SetVariable('tessedit_char_whitelist', whitelist)
+            apis[key] = api
+            with self._lock:
+                self._apis.append(api)
+        apis.move_to_end(key)
+        return apis[key]
+
+    def _end_api(self, key: Tuple[PSM, Optional[str]], api: PyTessBaseAPI):
+        self._local.page_ids.pop(key, None)
+        with self._lock:
+            self._apis.remove(api)
+        api.End()
+
+    def set_page(self, seg_mode: PSM, page: "PageTextExtractor", whitelist: Optional[str] = None) -> PyTessBaseAPI:
+        """
+        Engine of current thread for seg_mode and whitelist with page image set,
+        image is set only when engine has another page
+        """
+        api = self.get_api(seg_mode, whitelist)
+        if self._local.page_ids.get((seg_mode, whitelist)) != page.page_id:
+            if self.adaptive_learning:
+                # Results of a page shouldn't depend on pages recognized before by the same engine
+                api.ClearAdaptiveClassifier()
+            api.SetImageBytes(*page.image_bytes)
+            if page.resolution:
+                api.SetSourceResolution(page.resolution)
+            self._local.page_ids[(seg_mode, whitelist)] = page.page_id
+        return api
+
+    def page(self, image: np.ndarray, source_resolution: Optional[int] = None,
+             ocr_resolution: Optional[int] = None) -> "PageTextExtractor":
+        return PageTextExtractor(self, image, source_resolution, ocr_resolution)
+
+    def _mark_pool_thread(self):
+        self._local.pool_thread = True
+
+    def _in_pool_thread(self) -> bool:
+        return getattr(self._local, 'pool_thread', False)
+
+    def _get_executors(self) -> List[ThreadPoolExecutor]:
+        with self._lock:
+            if not self._executors:
+                self._executors = [ThreadPoolExecutor(1, thread_name_prefix=f'tesseract_{idx}',
+                                                      initializer=self._mark_pool_thread)
+                                   for idx in range(self.max_workers)]
+            return self._executors
+
+    def run(self, func: Callable[[], Any], affinity: int = 0) -> Any:
+        """
+        Call func in a pool thread and wait for its result, func sees context variables of the caller
+        @param affinity: calls with the same affinity, like page id, run in the same thread
+        """
+        if self._in_pool_thread():
+            return func()
+        executors = self._get_executors()
+        return executors[affinity % len(executors)].submit(contextvars.copy_context().run, func).result()
+
+    def map(self, func: Callable[[Any], Any], items: Sequence, affinity: int = 0) -> List:
+        """
+        Apply func to items in pool threads, results keep items order.
+        Items are processed in order by the thread of affinity, without adaptive learning
+        large batches are split between all threads
+        """
+        if not items:
+            return []
+        if self.adaptive_learning or self.max_workers < 2 or len(items) < MIN_PARALLEL_RECTS \
+                or self._in_pool_thread():
+            return self.run(lambda: [func(item) for item in items], affinity)
+        executors = self._get_executors()
+        chunk_size = math.ceil(len(items) / len(executors))
+        chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+        futures = [executor.submit(contextvars.copy_context().run, lambda chunk=chunk: [func(item) for item in chunk])
+                   for executor, chunk in zip(executors, chunks)]
+        return [result for future in futures for result in future.result()]
+
+    def close(self):
+        """
+        End all engines, pool must not be used by any thread after close
+        """
+        with self._lock:
+            executors, self._executors = self._executors, []
+        for executor in executors:
+            executor.shutdown()
+        with self._lock:
+            for api in self._apis:
+                api.End()
+            self._apis = []
+        self._local = threading.local()
+
+
+class PageTextExtractor:
+    """
+    Serves rectangle requests of a single page image from engines of TesseractPool,
+    image is converted once and set to each engine once per page.
+    Page is downscaled once to ocr_resolution if it is rendered with higher resolution,
+    requests and results are in page coordinates.
+    """
+    _page_ids = itertools.count()
+
+    def __init__(self, pool: TesseractPool, image: np.ndarray, source_resolution: Optional[int] = None,
+                 ocr_resolution: Optional[int] = None):
+        """
+        @param ocr_resolution: resolution image is recognized with, tesseract is tuned for text heights of 300 DPI
+        """
+        self.pool = pool
+        self.image = image
+        self.source_resolution = source_resolution
+        if source_resolution and ocr_resolution and ocr_resolution < source_resolution:
+            self.scale = ocr_resolution / source_resolution
+            self.resolution = ocr_resolution
+        else:
+            self.scale = 1.
+            self.resolution = source_resolution
+        self.page_id = next(self._page_ids)
+        self._ocr_image = None
+        self._image_bytes = None
+        self._words: Dict[PSM, List[OcrWord]] = {}
+        self._words_lock = threading.Lock()
+
+    @property
+    def ocr_image(self) -> np.ndarray:
+        """
+        Image passed to tesseract
+        """
+        if self._ocr_image is None:
+            if self.scale == 1.:
+                self._ocr_image = self.image
+            else:
+                height, width = self.image.shape[:2]
+                self._ocr_image = cv2.resize(self.image,
+                                             (max(1, round(width * self.scale)), max(1, round(height * self.scale))),
+                                             interpolation=cv2.INTER_AREA)
+        return self._ocr_image
+
+    @property
+    def image_bytes(self) -> Tuple[bytes, int, int, int, int]:
+        if self._image_bytes is None:
+            self._image_bytes = to_tesseract_image(self.ocr_image)
+        return self._image_bytes
+
+    def _to_ocr_rect(self, rect: Tuple) -> Tuple:
+        """
+        Smallest rectangle of ocr_image covering page rectangle
+        """
+        if self.scale == 1. or any([e is None for e in rect]):
+            return rect
+        x, y, w, h = rect
+        x1, y1 = math.floor(x * self.scale), math.floor(y * self.scale)
+        x2, y2 = math.ceil((x + w) * self.scale), math.ceil((y + h) * self.scale)
+        return x1, y1, x2 - x1, y2 - y1
+
+    def _regions_to_page(self, rect: Tuple, ocr_rect: Tuple, result: Tuple) -> Tuple:
+        """
+        Tesseract regions are relative to requested rectangle, map them from ocr_rect to page rect
+        """
+        text, conf, regions = result
+        if self.scale == 1. or not regions:
+            return result
+        mapped = []
+        for region_image, box in regions:
+            x1 = (ocr_rect[0] + box['x']) / self.scale - rect[0]
+            y1 = (ocr_rect[1] + box['y']) / self.scale - rect[1]
+            x2 = (ocr_rect[0] + box['x'] + box['w']) / self.scale - rect[0]
+            y2 = (ocr_rect[1] + box['y'] + box['h']) / self.scale - rect[1]
+            mapped.append((region_image, dict(box, x=round(x1), y=round(y1), w=round(x2 - x1), h=round(y2 - y1))))
+        return text, conf, mapped
+
+    def _set_rect(self, seg_mode: PSM, x=None, y=None, w=None, h=None, whitelist: Optional[str] = None) \
+            -> PyTessBaseAPI:
+        api = self.pool.set_page(seg_mode, self, whitelist)
+        if all([e is not None for e in [x, y, w, h]]):
+            api.SetRectangle(x, y, w, h)
+        else:
+            # Rectangle of previous request stays set on engine
+            api.SetRectangle(0, 0, self.ocr_image.shape[1], self.ocr_image.shape[0])
+        return api
+
+    def _extract(self, seg_mode: PSM, rect: Tuple, whitelist: Optional[str] = None) -> Tuple:
+        api = self._set_rect(seg_mode, *rect, whitelist=whitelist)
+        return api.GetUTF8Text(), api.MeanTextConf()
+
+    def _extract_region(self, seg_mode: PSM, rect: Tuple, whitelist: Optional[str] = None) -> Tuple:
+        api = self._set_rect(seg_mode, *rect, whitelist=whitelist)
+        return api.GetUTF8Text(), api.MeanTextConf(), api.GetRegions()
+
+    def _recognize_many(self, kind: str, seg_mode: PSM, rects: Sequence[Tuple],
+                        whitelist: Optional[str] = None) -> List[Tuple]:
+        ocr_rects = [self._to_ocr_rect(rect) for rect in rects]
+        results = self._recognize_ocr_rects(kind, seg_mode, ocr_rects, whitelist)
+        if kind == KIND_REGIONS:
+            return [self._regions_to_page(rect, ocr_rect, result)
+                    for rect, ocr_rect, result in zip(rects, ocr_rects, results)]
+        return results
+
+    def _recognize_ocr_rects(self, kind: str, seg_mode: PSM, rects: Sequence[Tuple],
+                             whitelist: Optional[str] = None) -> List[Tuple]:
+        """
+        Cache is looked up in the calling thread, only missed rectangles are recognized by the pool,
+        identical crops of one batch are recognized once
+        """
+        recognize = functools.partial(self._extract if kind == KIND_TEXT else self._extract_region, seg_mode,
+                                      whitelist=whitelist)
+        cache = self.pool.ocr_cache
+        if cache is None:
+            count('ocr_calls', len(rects))
+            return self.pool.map(recognize, rects, self.page_id)
+        to_dict, from_dict = RESULT_CODECS[kind]
+        keys = [cache.key(crop_image(self.ocr_image, *rect), seg_mode, kind, self.resolution, whitelist)
+                for rect in rects]
+        results: List[Optional[Tuple]] = [None] * len(rects)
+        missed: Dict[str, List[int]] = {}
+        for idx, key in enumerate(keys):
+            if key in missed:
+                missed[key].append(idx)
+                continue
+            cached = cache.get(key)
+            if cached is None:
+                missed[key] = [idx]
+            else:
+                results[idx] = from_dict(cached)
+        count('ocr_calls', len(missed))
+        count('ocr_cache_hits', len(rects) - len(missed))
+        recognized = self.pool.map(recognize, [rects[indices[0]] for indices in missed.values()], self.page_id)
+        for (key, indices), result in zip(missed.items(), recognized):
+            cache.put(key, to_dict(result))
+            for idx in indices:
+                results[idx] = result
+        return results
+
+    def extract(self, x=None, y=None, w=None, h=None, seg_mode: PSM = PSM.SPARSE_TEXT) -> Tuple:
+        return self._recognize_many(KIND_TEXT, seg_mode, [(x, y, w, h)])[0]
+
+    def extract_region(self, x, y, w, h, seg_mode: PSM = PSM.SPARSE_TEXT) -> Tuple:
+        """
+        Regions taken from ocr cache have None instead of region image
+        """
+        return self._recognize_many(KIND_REGIONS, seg_mode, [(x, y, w, h)])[0]
+
+    def extract_many(self, rects: Sequence[Tuple[int, int, int, int]], seg_mode: PSM = PSM.SPARSE_TEXT,
+                     whitelist: Optional[str] = None) -> List[Tuple]:
+        """
+        Result of extract for every (x, y, w, h) rectangle in rects order, rectangles are recognized in parallel
+        @param whitelist: characters recognition is restricted to
+        """
+        return self._recognize_many(KIND_TEXT, seg_mode, rects, whitelist)
+
+    def extract_regions_many(self, rects: Sequence[Tuple[int, int, int, int]],
+                             seg_mode: PSM = PSM.SPARSE_TEXT) -> List[Tuple]:
+        """
+        Result of extract_region for every (x, y, w, h) rectangle in rects order
+        """
+        return self._recognize_many(KIND_REGIONS, seg_mode, rects)
+
+    def page_words(self, seg_mode: PSM = PSM.SPARSE_TEXT) -> List[OcrWord]:
+        """
+        Words of the whole page in reading order, page is recognized once and words are kept
+        """
+        with self._words_lock:
+            if seg_mode not in self._words:
+                count('ocr_calls')
+                recognize = functools.partial(self._recognize_words, seg_mode)
+                self._words[seg_mode] = self.pool.run(recognize, self.page_id)
+            return self._words[seg_mode]
+
+    def _recognize_words(self, seg_mode: PSM) -> List[OcrWord]:
+        api = self._set_rect(seg_mode)
+        api.Recognize()
+        return iterate_words(api, self.scale)
+
+    def words_in(self, box: BorderBox, seg_mode: PSM = PSM.SPARSE_TEXT) -> List[OcrWord]:
+        return [word for word in self.page_words(seg_mode) if box_contains_center(box, word)]
+
+
+def iterate_words(api: PyTessBaseAPI, scale: float = 1.) -> List[OcrWord]:
+    """
+    @param scale: scale of recognized image to page, word boxes are returned in page coordinates
+    """
+    words = []
+    line = -1
+    result_iterator = api.GetIterator()
+    if result_iterator is None:
+        return words
+    for word in iterate_level(result_iterator, RIL.WORD):
+        if word.IsAtBeginningOf(RIL.TEXTLINE):
+            line += 1
+        text = word.GetUTF8Text(RIL.WORD)
+        bbox = word.BoundingBox(RIL.WORD)
+        if not text or not text.strip() or bbox is None:
+            continue
+        words.append(OcrWord(
+            bbox=BorderBox(
+                top_left_x=math.floor(bbox[0] / scale),
+                top_left_y=math.floor(bbox[1] / scale),
+                bottom_right_x=math.ceil(bbox[2] / scale),
+                bottom_right_y=math.ceil(bbox[3] / scale)
+            ),
+            text=text.strip(),
+            line=max(line, 0)
+        ))
+    return words
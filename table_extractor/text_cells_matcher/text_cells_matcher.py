@@ -1,37 +1,53 @@
-from typing import List, Tuple
+from typing import List, Tuple, Sequence
 
-from table_extractor.model.table import TextField, Cell, Table
+from table_extractor.model.spatial_index import BoxIndex
+from table_extractor.model.table import TextField, Cell, Table, BorderBox
 
 
 def match_table_text(table: Table, text_boxes: List[TextField]):
-    in_table: List[TextField] = []
-    out_of_table: List[TextField] = []
-    for t_box in text_boxes:
-        if t_box.bbox.box_is_inside_another(table.bbox):
-            in_table.append(t_box)
-        else:
-            out_of_table.append(t_box)
+    index = BoxIndex(text_boxes, key=lambda t_box: t_box.bbox)
+    inside = set(idx for idx in index.query(table.bbox)
+                 if text_boxes[idx].bbox.box_is_inside_another(table.bbox))
+    in_table: List[TextField] = [t_box for idx, t_box in enumerate(text_boxes) if idx in inside]
+    out_of_table: List[TextField] = [t_box for idx, t_box in enumerate(text_boxes) if idx not in inside]
     return in_table, out_of_table
 
 
-def match_cells_text(cells: List[Cell], text_box: TextField):
-    for cell in cells:
-        if text_box.bbox.box_is_inside_another(cell, threshold=0.6):
-            cell.text_boxes.append(text_box)
-            return True
-    return False
-
-
 def match_cells_text_fields(cells: List[Cell], text_boxes: List[TextField]) -> Tuple[int, List[TextField]]:
     count = 0
     for cell in cells:
         cell.text_boxes = []
     not_matched = []
+    index = BoxIndex(cells)
     for t_box in text_boxes:
-        if match_cells_text(cells, t_box):
+        cell = index.first_inside_another(t_box.bbox, threshold=0.6)
+        if cell is not None:
+            cell.text_boxes.append(t_box)
             count += 1
         else:
             not_matched.append(t_box)
 
     return count, not_matched
 
+
+def box_contains_center(box: BorderBox, text_field: TextField) -> bool:
+    center_x = (text_field.bbox.top_left_x + text_field.bbox.bottom_right_x) / 2
+    center_y = (text_field.bbox.top_left_y + text_field.bbox.bottom_right_y) / 2
+    return box.top_left_x <= center_x <= box.bottom_right_x and box.top_left_y <= center_y <= box.bottom_right_y
+
+
+def assign_words_to_cells(cells: Sequence[BorderBox], words: List[TextField]) -> List[List[TextField]]:
+    """
+    Words of every cell in cells order, word goes to the first cell containing center of the word,
+    words keep their order inside a cell
+    """
+    cells_words: List[List[TextField]] = [[] for _ in cells]
+    index = BoxIndex(cells)
+    for word in words:
+        center_x = (word.bbox.top_left_x + word.bbox.bottom_right_x) / 2
+        center_y = (word.bbox.top_left_y + word.bbox.bottom_right_y) / 2
+        # Cells overlapping the center point are the ones containing it, query keeps cells order
+        containing = index.query(BorderBox(center_x, center_y, center_x, center_y))
+        if containing:
+            cells_words[containing[0]].append(word)
+    return cells_words